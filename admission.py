@@ -0,0 +1,181 @@
+import logging
+import math
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+Limits = namedtuple("Limits", ["requests_per_minute", "burst", "max_in_flight"])
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, customer_id, dimension, retry_after, reason):
+        super().__init__(f"{reason} for customer {customer_id} ({dimension}), retry in {retry_after} s")
+        self.customer_id = customer_id
+        self.dimension = dimension
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute, burst):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def reconfigure(self, requests_per_minute, burst):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def take(self):
+        # Returns 0 when a token was taken, otherwise seconds until one is available
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (1 - self.tokens) / self.rate
+
+
+class _Waiter:
+    __slots__ = ("key", "max_in_flight", "slots", "granted")
+
+    def __init__(self, key, max_in_flight, slots):
+        self.key = key
+        self.max_in_flight = max_in_flight
+        self.slots = slots
+        self.granted = False
+
+
+class AdmissionController:
+    # Token buckets per (customer, dimension), a per-(customer, dimension)
+    # in-flight cap and a shared pool of backend slots handed out round-robin
+    # across customers, so one heavy tenant cannot starve the others.
+
+    def __init__(self, limits_loader, default_limits, max_in_flight_total=32,
+                 max_wait_s=10.0, limits_ttl_s=60.0):
+        self.limits_loader = limits_loader
+        self.default_limits = default_limits
+        self.max_in_flight_total = max_in_flight_total
+        self.max_wait_s = max_wait_s
+        self.limits_ttl_s = limits_ttl_s
+        self._cond = threading.Condition()
+        self._limits = {}
+        self._buckets = {}
+        self._in_flight = {}
+        self._in_flight_total = 0
+        self._waiting = {}
+        self._round_robin = deque()
+        self._avg_duration = 1.0
+
+    def get_limits(self, customer_id, dimension):
+        key = (customer_id, dimension)
+        cached = self._limits.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        try:
+            limits = self.limits_loader(customer_id, dimension) or self.default_limits
+        except Exception as e:
+            logger.error(f"Error loading rate limits for {customer_id}: {e}")
+            limits = cached[0] if cached else self.default_limits
+        self._limits[key] = (limits, time.monotonic() + self.limits_ttl_s)
+        return limits
+
+    def _retry_after(self, seconds):
+        return max(1, math.ceil(seconds))
+
+    def _can_run(self, waiter):
+        return (self._in_flight_total + waiter.slots <= self.max_in_flight_total
+                and self._in_flight.get(waiter.key, 0) + waiter.slots <= waiter.max_in_flight)
+
+    def _dispatch(self):
+        # Grant free slots by cycling over customers with queued requests
+        idle_turns = 0
+        while self._round_robin and idle_turns < len(self._round_robin):
+            if self._in_flight_total >= self.max_in_flight_total:
+                break
+            customer_id = self._round_robin.popleft()
+            queue = self._waiting[customer_id]
+            waiter = queue[0]
+            if self._can_run(waiter):
+                queue.popleft()
+                waiter.granted = True
+                self._in_flight[waiter.key] = self._in_flight.get(waiter.key, 0) + waiter.slots
+                self._in_flight_total += waiter.slots
+                idle_turns = 0
+            else:
+                idle_turns += 1
+            if queue:
+                self._round_robin.append(customer_id)
+            else:
+                del self._waiting[customer_id]
+        self._cond.notify_all()
+
+    def _withdraw(self, customer_id, waiter):
+        queue = self._waiting.get(customer_id)
+        if queue is None:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._waiting[customer_id]
+            self._round_robin.remove(customer_id)
+
+    @contextmanager
+    def admit(self, customer_id, dimension, slots=1):
+        # One rate-limit token per request, but up to `slots` concurrent backend
+        # calls (capped by the limits); yields the number of slots granted
+        limits = self.get_limits(customer_id, dimension)
+        key = (customer_id, dimension)
+        slots = max(1, min(slots, limits.max_in_flight, self.max_in_flight_total))
+        waiter = _Waiter(key, limits.max_in_flight, slots)
+
+        with self._cond:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(limits.requests_per_minute, limits.burst)
+            else:
+                bucket.reconfigure(limits.requests_per_minute, limits.burst)
+            wait = bucket.take()
+            if wait > 0:
+                raise AdmissionRejected(customer_id, dimension, self._retry_after(min(wait, 3600)), "Rate limit reached")
+
+            if customer_id not in self._waiting:
+                self._waiting[customer_id] = deque()
+                self._round_robin.append(customer_id)
+            self._waiting[customer_id].append(waiter)
+            self._dispatch()
+
+            deadline = time.monotonic() + self.max_wait_s
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(customer_id, waiter)
+                    raise AdmissionRejected(customer_id, dimension, self._retry_after(self._avg_duration), "Too many requests in progress")
+                self._cond.wait(remaining)
+
+        started = time.monotonic()
+        try:
+            yield slots
+        finally:
+            with self._cond:
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - started)
+                self._in_flight[key] -= slots
+                if not self._in_flight[key]:
+                    del self._in_flight[key]
+                self._in_flight_total -= slots
+                self._dispatch()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "in_flight": self._in_flight_total,
+                "queued": sum(len(queue) for queue in self._waiting.values()),
+                "avg_duration_s": round(self._avg_duration, 3),
+            }
@@ -22,6 +22,25 @@ import os
 import tempfile
 import requests
 import json
+from password_hashing import hash_password, verify_password
+from admission import AdmissionController, AdmissionRejected, Limits
+from db import ConnectionPool, PoolTimeout, ReadRouter
+from concurrent.futures import ThreadPoolExecutor
+from image_preprocessing import prepare_document
+from pdf_sharding import page_count, split_pdf
+from singleflight import SingleFlight
+import job_queue
+import bulk_import
+from job_queue import JobWorkerPool, RetryLater
+import chat_context
+from export_analyses import count_customer_analyses, export_customer_analyses
+from health import HealthChecker, current as current_health_checker, serve as serve_health
+import cache
+from cache import LocalBackend, PostgresBackend, TwoTierCache
+from botocore.config import Config
+import io
+import time
+from contextlib import contextmanager
 
 load_dotenv()
 
@@ -31,10 +50,54 @@ logger = logging.getLogger(__name__)
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-BACKEND_URL = "https://ffx5lzqebmrnwd37jfmyl4xeve0bcmvh.lambda-url.us-east-1.on.aws/"
+BACKEND_URL = os.getenv("BACKEND_URL", "https://ffx5lzqebmrnwd37jfmyl4xeve0bcmvh.lambda-url.us-east-1.on.aws/")
+# The backend is a Lambda function URL, which ends an invocation after at most
+# 15 minutes; waiting longer would only keep an admission slot held for nothing
+BACKEND_CONNECT_TIMEOUT_S = float(os.getenv("BACKEND_CONNECT_TIMEOUT_S", "5"))
+BACKEND_READ_TIMEOUT_S = float(os.getenv("BACKEND_READ_TIMEOUT_S", "900"))
 access_key = os.environ.get("aws_access_key")
 secret_key = os.environ.get("aws_secret_key")
 
+# Admission control for backend calls; per-customer overrides live in customer_rate_limits
+DEFAULT_RATE_LIMITS = Limits(
+    requests_per_minute=int(os.getenv("DEFAULT_REQUESTS_PER_MINUTE", "30")),
+    burst=int(os.getenv("DEFAULT_REQUEST_BURST", "5")),
+    max_in_flight=int(os.getenv("DEFAULT_MAX_IN_FLIGHT", "2")),
+)
+BACKEND_MAX_IN_FLIGHT = int(os.getenv("BACKEND_MAX_IN_FLIGHT", "16"))
+ADMISSION_MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", "10"))
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_CONNECT_TIMEOUT_S = int(os.getenv("DB_CONNECT_TIMEOUT_S", "5"))
+REPLICA_MAX_LAG_S = float(os.getenv("REPLICA_MAX_LAG_S", "5"))
+READ_YOUR_WRITES_S = float(os.getenv("READ_YOUR_WRITES_S", "30"))
+# PDFs longer than SHARD_THRESHOLD_PAGES are analyzed in SHARD_PAGES page ranges
+SHARD_THRESHOLD_PAGES = int(os.getenv("SHARD_THRESHOLD_PAGES", "20"))
+SHARD_PAGES = int(os.getenv("SHARD_PAGES", "10"))
+SHARD_PARALLELISM = int(os.getenv("SHARD_PARALLELISM", "4"))
+# Analyses run as jobs in analysis_jobs; set JOB_WORKERS_IN_PROCESS=0 when only worker.py processes should run them
+JOB_WORKERS_IN_PROCESS = int(os.getenv("JOB_WORKERS_IN_PROCESS", "2"))
+JOB_POLL_INTERVAL_S = float(os.getenv("JOB_POLL_INTERVAL_S", "2"))
+JOB_VISIBILITY_TIMEOUT_S = int(os.getenv("JOB_VISIBILITY_TIMEOUT_S", "900"))
+JOB_RESUME_WINDOW_S = int(os.getenv("JOB_RESUME_WINDOW_S", "3600"))
+JOB_METRICS_INTERVAL_S = float(os.getenv("JOB_METRICS_INTERVAL_S", "60"))
+# /livez and /readyz for the load balancer, served by serve.py; set HEALTH_PORT=0 to disable
+HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8502"))
+HEALTH_PROBE_TTL_S = float(os.getenv("HEALTH_PROBE_TTL_S", "15"))
+HEALTH_PROBE_TIMEOUT_S = float(os.getenv("HEALTH_PROBE_TIMEOUT_S", "3"))
+# Memoized lookups shared by all replicas; CACHE_BACKEND=local keeps the back tier in-process
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "postgres")
+CACHE_FRONT_SIZE = int(os.getenv("CACHE_FRONT_SIZE", "2048"))
+CACHE_FRONT_TTL_S = float(os.getenv("CACHE_FRONT_TTL_S", "60"))
+CACHE_TTL_S = float(os.getenv("CACHE_TTL_S", "600"))
+ENTITLEMENTS_CACHE_TTL_S = float(os.getenv("ENTITLEMENTS_CACHE_TTL_S", "300"))
+# Identical uploads from the same customer reuse the earlier analysis; 0 disables
+ANALYSIS_CACHE_TTL_S = float(os.getenv("ANALYSIS_CACHE_TTL_S", "3600"))
+# The download button holds the whole file in memory, so the UI only serves
+# small exports; larger ones go through the streaming export_analyses.py CLI
+EXPORT_UI_MAX_ROWS = int(os.getenv("EXPORT_UI_MAX_ROWS", "5000"))
+EXPORT_UI_MAX_BYTES = int(os.getenv("EXPORT_UI_MAX_BYTES", str(50 * 1024 * 1024)))
+
 def get_secret(secret_name, region_name):
     # Create a session using the loaded environment variables
     session = boto3.session.Session(
@@ -84,6 +147,8 @@ bucket_name=credentials.get("bucket_name")
 region_name=credentials.get("region_name")
 SENDER_EMAIL=credentials.get("SENDER_EMAIL")
 RDS_DB_PORT=credentials.get("RDS_DB_PORT")
+# Optional read replica endpoint; read-only helpers use it when present
+RDS_DB_READER_HOST=credentials.get("RDS_DB_READER_HOST")
 
         
 
@@ -154,96 +219,383 @@ def submit_usage_record(customer_identifier, product_code, dimension, quantity):
 # )
 
 def get_marketplace_customer_id(email):
-    print(email)
-    conn = get_db_connection()
-    if not conn:
-        logging.error("Unable to connect to the database")
-        return None
+    return get_cache().get(f"customer_id:{email}", lambda: load_marketplace_customer_id(email), CACHE_TTL_S)
 
-    cur = conn.cursor()
+def load_marketplace_customer_id(email):
+    print(email)
     try:
-        cur.execute("SELECT customer_id FROM users WHERE email = %s", (email,))
-        result = cur.fetchone()
-        print(result)
+        result = get_db_router().fetchone("get_marketplace_customer_id", (email,), readonly=True, key=email)
         if not result:
             logging.error(f"No user found with email: {email}")
             return None
-        
-        user_customer_id = result[0]
-        print(user_customer_id)
 
-        cur.execute("SELECT customer_id FROM product_customers WHERE id = %s", (user_customer_id,))
-        result = cur.fetchone()
-        
-        if not result:
+        user_customer_id, marketplace_customer_id = result
+        if not marketplace_customer_id:
             logging.error(f"No product customer found for user customer_id: {user_customer_id}")
             return None
-        print(result[0])
-        return result[0] 
+        return marketplace_customer_id
     # This is the marketplace customer_id
+    except (psycopg2.OperationalError, PoolTimeout) as e:
+        logging.error(f"Unable to connect to the database: {e}")
+        return None
     except Exception as e:
         logging.error(f"Error retrieving marketplace customer ID: {e}")
         return None
-    finally:
-        cur.close()
-        conn.close()
 
 
+@st.cache_resource
+def get_admission_controller():
+    return AdmissionController(
+        load_customer_rate_limits,
+        DEFAULT_RATE_LIMITS,
+        max_in_flight_total=BACKEND_MAX_IN_FLIGHT,
+        max_wait_s=ADMISSION_MAX_WAIT_S,
+    )
 
-def analyze_and_summarize_pdf(file):
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(file.getvalue())
-            tmp_file_path = tmp_file.name
+def show_busy_message(rejection):
+    st.warning(f"The analyzer is busy for your account. Please retry in {rejection.retry_after} s.")
 
-        with open(tmp_file_path, 'rb') as pdf_file:
-            files = {'file': pdf_file}
-            response = requests.post(f"{BACKEND_URL}/analyze-text-from-pdf/", files=files)
+class BackendError(Exception):
+    pass
 
-        if os.path.exists(tmp_file_path):
-            os.remove(tmp_file_path)
+def post_pdf_for_analysis(data, filename="report.pdf"):
+    started = time.perf_counter()
+    files = {'file': (filename, data, 'application/pdf')}
+    try:
+        response = requests.post(
+            f"{BACKEND_URL}/analyze-text-from-pdf/",
+            files=files,
+            timeout=(BACKEND_CONNECT_TIMEOUT_S, BACKEND_READ_TIMEOUT_S),
+        )
+    except requests.Timeout:
+        raise BackendError("The analyzer did not respond in time")
+    logging.info(
+        f"Analyzed {len(data) / 1024:.0f} KiB in {time.perf_counter() - started:.2f} s "
+        f"(status {response.status_code})"
+    )
+    if response.status_code != 200:
+        raise BackendError(f"Error analyzing PDF: {response.status_code}")
+    result = response.json()
+    return result['result'], result['analysis_id']
+
+def analyze_sharded_pdf(shards, parallelism):
+    # Large PDFs are analyzed as page ranges in parallel and merged into one report.
+    # parallelism is the number of admission slots held, one per concurrent backend call.
+    def analyze_shard(shard):
+        first, last, shard_data = shard
+        return post_pdf_for_analysis(shard_data, f"pages-{first}-{last}.pdf")
+
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="shard") as executor:
+        results = list(executor.map(analyze_shard, shards))
+
+    sections = []
+    for (first, last, _), (result, _) in zip(shards, results):
+        heading = f"Page {first}" if first == last else f"Pages {first}-{last}"
+        sections.append(f"**{heading}**\n\n{result}")
+    # The first shard's analysis id identifies the merged report. The chat
+    # endpoint takes a single analysis_id, so chat only knows that shard's pages;
+    # the note is part of the report text so it survives the job table and cache.
+    analysis_ids = [analysis_id for _, analysis_id in results]
+    logging.info(f"Merged {len(shards)} shards into analysis {analysis_ids[0]} (shards: {analysis_ids})")
+    if len(shards) > 1:
+        first, last, _ = shards[0]
+        covered = f"page {first}" if first == last else f"pages {first}-{last}"
+        sections.append(f"_Note: the chatbot answers questions using {covered} of this report only._")
+    return "\n\n".join(sections), analysis_ids[0]
+
+# Identical concurrent requests (same file, or same question on the same analysis)
+# from any session in this process share a single backend call
+@st.cache_resource
+def get_request_coalescers():
+    return {"analysis": SingleFlight("analysis"), "chat": SingleFlight("chat")}
+
+def get_coalescing_stats():
+    return {name: flight.stats() for name, flight in get_request_coalescers().items()}
+
+def run_analysis(customer_id, data):
+    try:
+        pages = page_count(data)
+    except Exception as e:
+        logging.warning(f"Could not read PDF page count, sending it unsharded: {e}")
+        pages = 0
+
+    shards = None
+    if pages > SHARD_THRESHOLD_PAGES:
+        shards = split_pdf(data, SHARD_PAGES)
+        if not shards:
+            raise BackendError("The PDF has no readable pages")
+
+    # One rate-limit token per report, but a slot per concurrent shard request,
+    # so max_in_flight and BACKEND_MAX_IN_FLIGHT still cap backend concurrency
+    wanted = min(SHARD_PARALLELISM, len(shards)) if shards else 1
+    with get_admission_controller().admit(customer_id, "ReportGeneration", slots=wanted) as slots:
+        if shards:
+            return analyze_sharded_pdf(shards, slots)
+        return post_pdf_for_analysis(data)
+
+def cached_analysis(customer_id, file_sha256, data):
+    key = f"{customer_id}:{file_sha256}"
+    def analyze():
+        return get_request_coalescers()["analysis"].do(key, run_analysis, customer_id, data)
+    if ANALYSIS_CACHE_TTL_S <= 0:
+        return analyze()
+    result, analysis_id = get_cache().get(f"analysis:{key}", analyze, ANALYSIS_CACHE_TTL_S)
+    return result, analysis_id
 
-        if response.status_code == 200:
-            result = response.json()
-            return result['result'], result['analysis_id']
-        else:
-            st.error(f"Error analyzing PDF: {response.status_code}")
-            return None, None
+def analyze_and_summarize_pdf(file):
+    customer_id = get_session_customer_id() or st.session_state.user_email
+    try:
+        data = file.getvalue()
+        return cached_analysis(customer_id, hashlib.sha256(data).hexdigest(), data)
+    except AdmissionRejected as e:
+        logging.warning(str(e))
+        show_busy_message(e)
+        return None, None
+    except BackendError as e:
+        st.error(str(e))
+        return None, None
     except Exception as e:
         st.error(f"Error processing PDF: {str(e)}")
         return None, None
-    finally:
-        if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path):
-            try:
-                os.remove(tmp_file_path)
-            except Exception as e:
-                st.error(f"Error deleting temporary file: {str(e)}")
 
 
 
 
+def run_chat(customer_id, data):
+    with get_admission_controller().admit(customer_id, "UsageBased"):
+        try:
+            response = requests.post(
+                f"{BACKEND_URL}/chat/",
+                json=data,
+                timeout=(BACKEND_CONNECT_TIMEOUT_S, BACKEND_READ_TIMEOUT_S),
+            )
+        except requests.Timeout:
+            raise BackendError("The chatbot did not respond in time")
+    if response.status_code != 200:
+        raise BackendError("Error chatting with bot")
+    return response.json()['response']
+
 def chat_with_bot(user_message):
-    data = {"user_message": user_message}
-    response = requests.post(f"{BACKEND_URL}/chat/", json=data)
-    if response.status_code == 200:
-        return response.json()['response']
+    customer_id = get_session_customer_id() or st.session_state.user_email
+    analysis_id = st.session_state.get("analysis_id")
+    # analysis_id plus a token-budgeted window of the conversation, not the whole history
+    if "chat_context" not in st.session_state:
+        st.session_state.chat_context = chat_context.new_state()
+    data = chat_context.build_payload(
+        user_message, analysis_id, st.session_state.conversation, st.session_state.chat_context
+    )
+    logging.debug(f"Chat payload is {len(json.dumps(data))} bytes")
+    key = f"{customer_id}:{analysis_id}:{hashlib.sha256(user_message.encode()).hexdigest()}"
+    try:
+        return get_request_coalescers()["chat"].do(key, run_chat, customer_id, data)
+    except AdmissionRejected as e:
+        logging.warning(str(e))
+        show_busy_message(e)
+        return None
+    except BackendError as e:
+        st.error(str(e))
+        return None
+
+def process_analysis_job(customer_id, file_sha256, data):
+    try:
+        return cached_analysis(customer_id, file_sha256, data)
+    except AdmissionRejected as e:
+        raise RetryLater(e.retry_after, str(e))
+
+@st.cache_resource
+def start_analysis_workers():
+    if JOB_WORKERS_IN_PROCESS <= 0:
+        return None
+    return JobWorkerPool(
+        get_db_router().connection,
+        process_analysis_job,
+        threads=JOB_WORKERS_IN_PROCESS,
+        visibility_timeout_s=JOB_VISIBILITY_TIMEOUT_S,
+        metrics_interval_s=JOB_METRICS_INTERVAL_S,
+    ).start()
+
+def enqueue_analysis(data):
+    customer_id = get_session_customer_id() or st.session_state.user_email
+    return job_queue.enqueue(
+        get_db_router().connection,
+        st.session_state.user_email,
+        customer_id,
+        hashlib.sha256(data).hexdigest(),
+        data
+    )
+
+def get_analysis_job(job_id):
+    return job_queue.get_job(get_db_router().connection, job_id, st.session_state.user_email)
+
+def submit_report_usage():
+    return submit_usage_record(
+        get_session_customer_id(),
+        product_code='db70sghlx0y4s77pfepvtx74q',
+        dimension='ReportGeneration',
+        quantity=1
+    )
+
+# Bills a finished analysis once, whichever session or tab shows it first
+def meter_analysis_job(job_id):
+    try:
+        if not job_queue.claim_metering(get_db_router().connection, job_id):
+            return
+    except Exception as e:
+        logging.error(f"Error recording metering for analysis job {job_id}: {e}")
+        return
+    if submit_report_usage() is None:
+        # Let the next view try again
+        try:
+            job_queue.release_metering(get_db_router().connection, job_id)
+        except Exception as e:
+            logging.error(f"Error releasing metering for analysis job {job_id}: {e}")
+
+def find_recent_analysis_job():
+    try:
+        return job_queue.latest_job_id(get_db_router().connection, st.session_state.user_email, JOB_RESUME_WINDOW_S)
+    except Exception as e:
+        logging.error(f"Error looking up recent analysis jobs: {e}")
+        return None
+
+@st.cache_resource
+def get_cache():
+    if CACHE_BACKEND == "postgres":
+        back = PostgresBackend(lambda: get_db_router().primary, get_db_connection)
     else:
-        st.error("Error chatting with bot")
+        back = LocalBackend()
+    return TwoTierCache(back, front_size=CACHE_FRONT_SIZE, front_ttl_s=CACHE_FRONT_TTL_S).start()
+
+def invalidate_user_cache(email):
+    get_cache().invalidate(f"customer_id:{email}", f"user_name:{email}")
+
+def probe_reader(router):
+    reader = router.get_reader()
+    if reader is None:
+        raise RuntimeError("read replica unavailable, reads use the primary")
+    probe_database(reader)
+
+def probe_database(pool):
+    with pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT 1")
+        cur.fetchone()
+
+def probe_secrets_manager(client):
+    # Metadata only; the secret value is never fetched by health checks
+    client.describe_secret(SecretId="marketplace/patientlabreportanalyzer")
+
+def probe_ses(client):
+    quota = client.get_send_quota()
+    return {"sent_last_24h": quota["SentLast24Hours"], "max_24h_send": quota["Max24HourSend"]}
+
+def probe_backend():
+    # Any HTTP response means the function URL is reachable; only 5xx counts as down
+    response = requests.get(BACKEND_URL, timeout=HEALTH_PROBE_TIMEOUT_S)
+    if response.status_code >= 500:
+        raise RuntimeError(f"Backend returned {response.status_code}")
+    return {"http_status": response.status_code}
+
+# Called by serve.py at process start, before any session renders the page
+def start_health_server():
+    if HEALTH_PORT <= 0:
+        return None
+    session = boto3.Session(
+        aws_access_key_id=os.getenv('aws_access_key'),
+        aws_secret_access_key=os.getenv('aws_secret_key'),
+        region_name='us-east-1'
+    )
+    aws_config = Config(
+        connect_timeout=HEALTH_PROBE_TIMEOUT_S,
+        read_timeout=HEALTH_PROBE_TIMEOUT_S,
+        retries={"max_attempts": 1},
+    )
+    secrets_client = session.client('secretsmanager', config=aws_config)
+    ses_client = session.client('ses', config=aws_config)
+
+    router = get_db_router()
+    checker = HealthChecker(timeout_s=HEALTH_PROBE_TIMEOUT_S)
+    checker.add_probe("database", lambda: probe_database(router.primary), HEALTH_PROBE_TTL_S)
+    if router.has_reader:
+        # Reads fall back to the primary, so a lost replica does not take the node out
+        checker.add_probe("database_reader", lambda: probe_reader(router), HEALTH_PROBE_TTL_S, critical=False)
+    checker.add_probe("secrets_manager", lambda: probe_secrets_manager(secrets_client), HEALTH_PROBE_TTL_S * 4)
+    checker.add_probe("ses", lambda: probe_ses(ses_client), HEALTH_PROBE_TTL_S * 4, critical=False)
+    checker.add_probe("backend", probe_backend, HEALTH_PROBE_TTL_S)
+    try:
+        return serve_health(checker, HEALTH_PORT)
+    except OSError as e:
+        # Another app process on this host already serves the port
+        logging.warning(f"Health endpoints not started on port {HEALTH_PORT}: {e}")
         return None
 
+# The script's coalescers, admission controller and cache are separate from the
+# ones serve.py imported, so report these once the first session has rendered
+@st.cache_resource
+def register_health_stats():
+    checker = current_health_checker()
+    if checker is None:
+        return None
+    checker.add_stats("coalescing", get_coalescing_stats)
+    checker.add_stats("admission", lambda: get_admission_controller().stats())
+    checker.add_stats("cache", lambda: get_cache().stats())
+    workers = start_analysis_workers()
+    if workers is not None:
+        # Last values read by the workers' metrics thread; None until the first interval
+        checker.add_stats("job_queue", lambda: workers.metrics)
+    return checker
+
 # Database connection function
-def get_db_connection():
+def get_db_connection(readonly=False):
+    # Bulk reads that tolerate replica lag can use the reader endpoint
+    host = RDS_DB_READER_HOST if readonly and RDS_DB_READER_HOST else RDS_DB_HOST
     try:
         return psycopg2.connect(
             dbname=RDS_DB_NAME,
             user=RDS_DB_USER,
             password=RDS_DB_PASSWORD,
-            host=RDS_DB_HOST,
+            host=host,
             port=RDS_DB_PORT
         )
     except Exception as e:
         logging.error(f"Error connecting to database: {e}")
         return None
+
+# Pooled connections for the hot queries; statements are prepared once per connection.
+# Writes go to the primary, read-only helpers to the replica when one is configured.
+@st.cache_resource
+def get_db_router():
+    def make_pool(host):
+        return ConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
+            dbname=RDS_DB_NAME,
+            user=RDS_DB_USER,
+            password=RDS_DB_PASSWORD,
+            host=host,
+            port=RDS_DB_PORT,
+            connect_timeout=DB_CONNECT_TIMEOUT_S
+        )
+
+    # The reader pool is built on first use, so a replica that is down at boot
+    # is retried after the router's backoff instead of being off until restart
+    return ReadRouter(
+        make_pool(RDS_DB_HOST),
+        max_lag_s=REPLICA_MAX_LAG_S,
+        sticky_s=READ_YOUR_WRITES_S,
+        make_reader=(lambda: make_pool(RDS_DB_READER_HOST)) if RDS_DB_READER_HOST else None,
+    )
+
+@st.cache_resource
+def get_email_executor():
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="email")
+
+def send_welcome_email_async(email, username):
+    def log_result(future):
+        if future.exception() is None and future.result():
+            logging.info(f"Welcome email sent to {email}")
+        else:
+            logging.error(f"Failed to send welcome email to {email}")
+
+    get_email_executor().submit(send_welcome_email, email, username).add_done_callback(log_result)
    
 # Create users table
 
@@ -319,30 +671,122 @@ def add_unique_constraint_to_customer_id():
         cur.close()
         conn.close()
 
-# Call these functions at the start of your app
-# create_product_customers_table()
-# create_users_table()
-# add_unique_constraint_to_customer_id()
-def table_exists(table_name):
+def create_customer_rate_limits_table():
     conn = get_db_connection()
     if not conn:
-        return False
+        return
+
     cur = conn.cursor()
     try:
-        cur.execute(f"""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_name = '{table_name}'
-            );
+        # customer_id is the marketplace customer id, '*' holds the defaults for every customer
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS customer_rate_limits (
+                customer_id VARCHAR(100) NOT NULL,
+                dimension VARCHAR(50) NOT NULL,
+                requests_per_minute INTEGER NOT NULL,
+                burst INTEGER NOT NULL,
+                max_in_flight INTEGER NOT NULL,
+                PRIMARY KEY (customer_id, dimension)
+            )
         """)
-        return cur.fetchone()[0]
+        conn.commit()
+        logging.info("Customer rate limits table created or already exists")
     except Exception as e:
-        logging.error(f"Error checking table existence: {e}")
-        return False
+        conn.rollback()
+        logging.error(f"Error creating customer_rate_limits table: {e}")
+    finally:
+        cur.close()
+        conn.close()
+
+def load_customer_rate_limits(customer_id, dimension):
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            SELECT requests_per_minute, burst, max_in_flight
+            FROM customer_rate_limits
+            WHERE customer_id IN (%s, '*') AND dimension = %s
+            ORDER BY customer_id = '*'
+            LIMIT 1
+        """, (customer_id, dimension))
+        result = cur.fetchone()
+        return Limits(*result) if result else None
+    finally:
+        cur.close()
+        conn.close()
+
+def create_analysis_jobs_table():
+    conn = get_db_connection()
+    if not conn:
+        return
+
+    cur = conn.cursor()
+    try:
+        cur.execute(job_queue.CREATE_JOBS_TABLE_SQL)
+        conn.commit()
+        logging.info("Analysis jobs table created or already exists")
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating analysis_jobs table: {e}")
+    finally:
+        cur.close()
+        conn.close()
+
+def create_email_outbox_table():
+    conn = get_db_connection()
+    if not conn:
+        return
+
+    cur = conn.cursor()
+    try:
+        cur.execute(bulk_import.CREATE_EMAIL_OUTBOX_SQL)
+        conn.commit()
+        logging.info("Email outbox table created or already exists")
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating email_outbox table: {e}")
+    finally:
+        cur.close()
+        conn.close()
+
+def create_shared_cache_table():
+    conn = get_db_connection()
+    if not conn:
+        return
+
+    cur = conn.cursor()
+    try:
+        cur.execute(cache.CREATE_CACHE_TABLE_SQL)
+        conn.commit()
+        logging.info("Shared cache table created or already exists")
+    except Exception as e:
+        conn.rollback()
+        logging.error(f"Error creating shared_cache table: {e}")
     finally:
         cur.close()
         conn.close()
 
+# Call these functions at the start of your app
+# create_product_customers_table()
+# create_users_table()
+# add_unique_constraint_to_customer_id()
+def table_exists(table_name):
+    try:
+        return get_db_router().fetchone("table_exists", (table_name,), readonly=True)[0]
+    except Exception as e:
+        logging.error(f"Error checking table existence: {e}")
+        return False
+
+def column_exists(table_name, column_name):
+    try:
+        return get_db_router().fetchone("column_exists", (table_name, column_name), readonly=True)[0]
+    except Exception as e:
+        logging.error(f"Error checking column existence: {e}")
+        return False
+
 def initialize_database():
     if not table_exists('product_customers'):
         create_product_customers_table()
@@ -354,6 +798,18 @@ def initialize_database():
     else:
         logging.info("Users table already exists")
 
+    if not table_exists('customer_rate_limits'):
+        create_customer_rate_limits_table()
+
+    if not table_exists('analysis_jobs') or not column_exists('analysis_jobs', 'metered_at'):
+        create_analysis_jobs_table()
+
+    if not table_exists('email_outbox') or not column_exists('email_outbox', 'locked_until'):
+        create_email_outbox_table()
+
+    if CACHE_BACKEND == "postgres" and not table_exists('shared_cache'):
+        create_shared_cache_table()
+
     # Check if the unique constraint exists before adding it
     conn = get_db_connection()
     if conn:
@@ -447,7 +903,7 @@ def signup(username, email, password, confirm_password):
         st.error("Please fill in all fields")
         return False
     else:
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+        hashed_password = hash_password(password)
         
         # Get the atrs value from URL query parameters
         atrs = st.query_params.get("atrs")
@@ -462,118 +918,90 @@ def signup(username, email, password, confirm_password):
             st.error("Invalid customer ID format.")
             return False
 
-        conn = get_db_connection()
-        if not conn:
-            st.error("Unable to connect to the database")
-            return False
-        
-        cur = conn.cursor()
-        
         try:
-            # Check if email already exists
-            cur.execute(
-                "SELECT email FROM users WHERE email = %s",
-                (email,)
+            email_exists, customer_exists, user_id = get_db_router().fetchone(
+                "signup_user", (username, email, hashed_password, customer_id), key=email
             )
-            existing_email = cur.fetchone()
-            if existing_email:
-                st.error("Email already exists")
-                return False
-
-            # Check if the customer_id exists in product_customers table
-            cur.execute(
-                "SELECT id FROM product_customers WHERE id = %s",
-                (customer_id,)
-            )
-            if cur.fetchone() is None:
-                st.error("This customer ID does not exist in the product_customers table.")
-                return False
-
-            # If all checks pass, proceed with user insertion
-            cur.execute(
-                "INSERT INTO users (username, email, password, customer_id) VALUES (%s, %s, %s, %s)",
-                (username, email, hashed_password, customer_id)
-            )
-            conn.commit()
-            st.session_state.user_email = email
-            st.success("You have successfully signed up!")
-            if send_welcome_email(email, username):
-                logging.info(f"Welcome email sent to {email}")
-            else:
-                logging.error(f"Failed to send welcome email to {email}")
-            
-            return True
         except psycopg2.IntegrityError as e:
             logging.error(f"IntegrityError during signup: {e}")
             st.error(f"An error occurred during signup: {e}")
             return False
+        except (psycopg2.OperationalError, PoolTimeout) as e:
+            logging.error(f"Error connecting to database: {e}")
+            st.error("Unable to connect to the database")
+            return False
         except Exception as e:
             logging.error(f"Error during signup: {e}")
             st.error(f"An unexpected error occurred during signup: {e}")
             return False
-        finally:
-            cur.close()
-            conn.close()
+
+        # user_id is empty without email_exists when a concurrent signup won the race
+        if email_exists or (customer_exists and user_id is None):
+            st.error("Email already exists")
+            return False
+        if not customer_exists:
+            st.error("This customer ID does not exist in the product_customers table.")
+            return False
+
+        invalidate_user_cache(email)
+        st.session_state.user_email = email
+        st.success("You have successfully signed up!")
+        send_welcome_email_async(email, username)
+        return True
 
 
             
 def verify_login(email, password):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
-    cur = conn.cursor()
-    
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    
     try:
-        cur.execute("SELECT email FROM users WHERE email=%s AND password=%s", (email, hashed_password))
-        user = cur.fetchone()
-        return user[0] if user else None
+        user = get_db_router().fetchone("get_user_credentials", (email,), readonly=True, key=email)
+        if not user:
+            return None
+        # Hashing runs in the worker pool, so don't hold a connection meanwhile
+        matches, needs_rehash = verify_password(password, user[1])
+        if not matches:
+            return None
     except Exception as e:
         logging.error(f"Error verifying login: {e}")
         return None
-    finally:
-        cur.close()
-        conn.close()
+    if needs_rehash:
+        # Upgrade legacy SHA-256 or under-cost hashes now that we know the plaintext.
+        # Optional: the password was correct, so a failure here must not fail the login.
+        try:
+            new_hash = hash_password(password)
+            get_db_router().fetchone("rehash_user_password", (new_hash, email, user[1]), key=email)
+            logging.info(f"Rehashed password for {email}")
+        except Exception as e:
+            logging.error(f"Error rehashing password for {email}, will retry at next login: {e}")
+    return user[0]
 
 def generate_random_password(length=12):
     characters = string.ascii_letters + string.digits + string.punctuation
     return ''.join(random.choice(characters) for i in range(length))
 
 def reset_password(email):
-    conn = get_db_connection()
-    if not conn:
+    new_password = generate_random_password()
+    hashed_password = hash_password(new_password)
+
+    try:
+        user = get_db_router().fetchone("set_user_password", (hashed_password, email), key=email)
+    except (psycopg2.OperationalError, PoolTimeout) as e:
+        logging.error(f"Error connecting to database: {e}")
         st.error("Unable to connect to the database")
         return False
-    
-    cur = conn.cursor()
-    
-    try:
-        cur.execute("SELECT email FROM users WHERE email=%s", (email,))
-        user = cur.fetchone()
-        if user:
-            new_password = generate_random_password()
-            hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
-            
-            cur.execute("UPDATE users SET password=%s WHERE email=%s", (hashed_password, email))
-            conn.commit()
-            
-            if send_reset_email(email, new_password):
-                return True
-            else:
-                st.error("Failed to send reset email")
-                return False
-        else:
-            st.error("Email not found")
-            return False
     except Exception as e:
         logging.error(f"Error during password reset: {e}")
         st.error("An error occurred during password reset")
         return False
-    finally:
-        cur.close()
-        conn.close()
+
+    if not user:
+        st.error("Email not found")
+        return False
+    invalidate_user_cache(email)
+    if send_reset_email(email, new_password):
+        return True
+    else:
+        st.error("Failed to send reset email")
+        return False
 
 
 def send_reset_email(email, new_password):
@@ -648,23 +1076,39 @@ if "user_email" not in st.session_state:
     
     
     
+# The marketplace customer id only changes with the logged-in user, so look it up once per session
+def get_session_customer_id():
+    cached = st.session_state.get("customer_id")
+    if cached and cached[0] == st.session_state.user_email:
+        return cached[1]
+    customer_id = get_marketplace_customer_id(st.session_state.user_email)
+    if customer_id:
+        st.session_state.customer_id = (st.session_state.user_email, customer_id)
+    return customer_id
+
+# Counts runs and render time per scope ("app" or a fragment) for this session
+@contextmanager
+def measure_render(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stats = st.session_state.setdefault("render_stats", {}).setdefault(name, {"runs": 0, "total_s": 0.0})
+        stats["runs"] += 1
+        stats["total_s"] += elapsed
+        logging.debug(f"Rendered {name} in {elapsed * 1000:.1f} ms (run {stats['runs']})")
+
 def get_user_name(email):
-    conn = get_db_connection()
-    if not conn:
-        return None
-    
-    cur = conn.cursor()
-    
+    return get_cache().get(f"user_name:{email}", lambda: load_user_name(email), CACHE_TTL_S)
+
+def load_user_name(email):
     try:
-        cur.execute("SELECT username FROM users WHERE email = %s", (email,))
-        result = cur.fetchone()
+        result = get_db_router().fetchone("get_user_name", (email,), readonly=True, key=email)
         return result[0] if result else None
     except Exception as e:
         logging.error(f"Error fetching user name for email {email}: {e}")
         return None
-    finally:
-        cur.close()
-        conn.close()
 
     
 if st.session_state.login_success and st.session_state.user_email:
@@ -742,7 +1186,13 @@ def login_page():
             
             
             
-def send_welcome_email(email, username):
+def send_welcome_email(email, username, imported=False):
+    # Imported accounts have no usable password until the user sets one
+    first_login_text = ""
+    first_login_html = ""
+    if imported:
+        first_login_text = 'Your account has been created for you. Before logging in for the first time, click "Forgot Password" on the login page and enter this email address to receive your password.'
+        first_login_html = f"<p>{first_login_text}</p>"
     sender_email = SENDER_EMAIL
     
     message = MIMEMultipart("alternative")
@@ -755,6 +1205,8 @@ def send_welcome_email(email, username):
 
             Welcome, and thank you for subscribing to GoML's Gen AI Capability - Lab Report Analyzer on AWS Marketplace! Log in to gain detailed insights into your lab reports by uploading them and asking questions.
 
+            {first_login_text}
+
             Click to Login - https://labreportanalyzer.goml.io/
 
             For more updates - Please visit https://www.goml.io/
@@ -773,6 +1225,8 @@ def send_welcome_email(email, username):
 
             <p>Welcome, and thank you for subscribing to GoML's Gen AI Capability - Lab Report Analyzer on AWS Marketplace! Log in to gain detailed insights into your lab reports by uploading them and asking questions.</p>
 
+            {first_login_html}
+
             <p>Click to Login - <a href="https://labreportanalyzer.goml.io/">https://labreportanalyzer.goml.io/</a></p>
 
             <p>For more updates - Please visit <a href="https://www.goml.io/">https://www.goml.io/</a></p>
@@ -855,86 +1309,138 @@ def reset_password_page():
         st.write("")  # This empty column helps to make the layout more compact
 
 def update_password(email, new_password):
-    conn = get_db_connection()
-    if not conn:
-        return False
-    
-    cur = conn.cursor()
-    
     try:
-        hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
-        
-        cur.execute("UPDATE users SET password = %s WHERE email = %s", (hashed_password, email))
-        
-        if cur.rowcount == 0:
+        hashed_password = hash_password(new_password)
+
+        updated = get_db_router().fetchone("set_user_password", (hashed_password, email), key=email)
+
+        if not updated:
             logging.error(f"No user found with email: {email}")
             return False
-        
-        conn.commit()
+
+        invalidate_user_cache(email)
         logging.info(f"Password updated successfully for email: {email}")
         return True
     except Exception as e:
         logging.error(f"Error updating password for email {email}: {e}")
         return False
-    finally:
-        cur.close()
-        conn.close()
+# Polls the queued analysis without rerunning the rest of the page
+@st.fragment(run_every=JOB_POLL_INTERVAL_S)
+def analysis_job_status():
+    try:
+        job = get_analysis_job(st.session_state.analysis_job_id)
+    except Exception as e:
+        # Keep polling; the job itself is safe in the database
+        logging.error(f"Error fetching analysis job {st.session_state.analysis_job_id}: {e}")
+        st.info("Checking on your analysis...")
+        return
+    if job is None:
+        st.session_state.analysis_job_id = None
+        st.rerun()
+    elif job["status"] == "done":
+        meter_analysis_job(job["id"])
+        st.session_state.text = job["result"]
+        st.session_state.analysis_id = job["analysis_id"]
+        st.session_state.content_generated = True
+        st.session_state.analysis_job_id = None
+        st.rerun()
+    elif job["status"] == "failed":
+        st.session_state.analysis_error = f"Error analyzing report: {job['error']}"
+        st.session_state.analysis_job_id = None
+        st.rerun()
+    elif job["status"] == "queued":
+        st.info("Your report is queued for analysis. You can keep this page open or come back later.")
+    else:
+        st.info("ANALYZING. You can keep this page open or come back later.")
+
 def home_page():
     st.markdown("<h3 style='font-size: 25px;'>Upload scanned images or PDFs of patient lab reports to get instant insights and answers to your queries</h3>", unsafe_allow_html=True)
     
-    uploaded_file = st.file_uploader("Choose a file", type=["pdf"])
-    if uploaded_file and st.button("ANALYZE"):
-        with st.spinner("ANALYZING"):
+    uploaded_files = st.file_uploader(
+        "Choose a PDF or one or more images of the report",
+        type=["pdf", "png", "jpg", "jpeg"],
+        accept_multiple_files=True
+    )
+    if "analysis_job_id" not in st.session_state:
+        # Pick up an analysis started before a reload or a dropped connection
+        st.session_state.analysis_job_id = find_recent_analysis_job()
+
+    if uploaded_files and st.button("ANALYZE"):
+        with st.spinner("UPLOADING"):
             try:
-                result, analysis_id = analyze_and_summarize_pdf(uploaded_file)
-                if result:
-                    st.session_state.text = result
-                    st.session_state.analysis_id = analysis_id
-                    st.session_state.uploaded_file = uploaded_file
-                    st.session_state.content_generated = True
+                # Scanned images are cleaned up locally and sent as one PDF
+                document, bytes_in, bytes_out = prepare_document(
+                    [(file.name, file.getvalue()) for file in uploaded_files]
+                )
+                # Logged for PDFs too, which are sent as uploaded
+                logging.info(
+                    f"Report of {len(uploaded_files)} file(s): {bytes_in / 1024:.0f} KiB received, "
+                    f"{bytes_out / 1024:.0f} KiB to analyze"
+                )
+                uploaded_file = io.BytesIO(document)
+                st.session_state.uploaded_file = uploaded_file
+                try:
+                    st.session_state.analysis_job_id = enqueue_analysis(document)
+                    st.session_state.content_generated = False
+                except Exception as e:
+                    logging.error(f"Error queueing analysis, analyzing inline: {e}")
+                    result, analysis_id = analyze_and_summarize_pdf(uploaded_file)
+                    if result:
+                        st.session_state.text = result
+                        st.session_state.analysis_id = analysis_id
+                        st.session_state.content_generated = True
+                        submit_report_usage()
+            except ValueError as e:
+                st.error(str(e))
             except Exception as e:
                 st.error(f"Error processing PDF: {e}")
+
+    if st.session_state.get("analysis_error"):
+        st.error(st.session_state.pop("analysis_error"))
+    if st.session_state.analysis_job_id:
+        analysis_job_status()
     
     if st.session_state.content_generated:
         st.markdown("Report Analysis")
         st.write(st.session_state.text)
-        customer_id = get_marketplace_customer_id(st.session_state.user_email)
-        submit_usage_record(
-            customer_id,
-            product_code='db70sghlx0y4s77pfepvtx74q',
-            dimension='ReportGeneration',
-            quantity=1
-        )
 
         # Move chatbot to sidebar when content is generated
-        st.sidebar.header("Chatbot🤖")
-        user_input = st.sidebar.text_input("Type your message here...", key="chat_input")
+        with st.sidebar:
+            chat_panel()
+
+# A chat turn reruns only this fragment, not the report, metering or account menu
+@st.fragment
+def chat_panel():
+    with measure_render("chat_panel"):
+        st.header("Chatbot🤖")
+        user_input = st.chat_input("Type your message here...", key="chat_input")
         if user_input:
-            customer_id = get_marketplace_customer_id(st.session_state.user_email)
-            submit_usage_record(
-            customer_id,
-            product_code='db70sghlx0y4s77pfepvtx74q',
-            dimension='UsageBased',
-            quantity=1
-            )
             bot_response = chat_with_bot(user_input)
             if bot_response:
+                # Billed only once answered; a turn rejected as busy is retried for free
+                submit_usage_record(
+                get_session_customer_id(),
+                product_code='db70sghlx0y4s77pfepvtx74q',
+                dimension='UsageBased',
+                quantity=1
+                )
                 st.session_state.conversation.insert(0, {"role": "assistant", "content": bot_response})
                 st.session_state.conversation.insert(0, {"role": "user", "content": user_input})
-        
+
         # Display conversation history in sidebar (recent conversations on top)
         for i in range(0, len(st.session_state.conversation), 2):
             if i+1 < len(st.session_state.conversation):
                 user_message = st.session_state.conversation[i]
                 bot_message = st.session_state.conversation[i+1]
-                
-                st.sidebar.write(f"**You:** {user_message['content']}")
-                st.sidebar.write(f"**Bot:** {bot_message['content']}")
+
+                st.write(f"**You:** {user_message['content']}")
+                st.write(f"**Bot:** {bot_message['content']}")
             else:
                 user_message = st.session_state.conversation[i]
-                st.sidebar.write(f"**You:** {user_message['content']}")
-            
-            st.sidebar.write("__________________________________________________________________________________________________________________________________________")
+                st.write(f"**You:** {user_message['content']}")
+
+            st.write("__________________________________________________________________________________________________________________________________________")
+
 def set_wide_layout():
     st.set_page_config(layout="wide")
     st.markdown(
@@ -947,46 +1453,128 @@ def set_wide_layout():
     """,
         unsafe_allow_html=True,
     )
+
+def show_export_too_large(customer_id, size):
+    logging.info(f"Export for {customer_id} is too large for the UI ({size}); use export_analyses.py --customer-id {customer_id}")
+    st.info(f"This export is too large to download here ({size}). Please contact contact@goml.io for a full export.")
+
+def export_panel():
+    st.subheader("Export analyses")
+    export_format = st.selectbox("Format", ["csv", "parquet"], key="export_format")
+    if not st.button("Prepare export", key="export_button"):
+        return
+    customer_id = get_session_customer_id()
+    if not customer_id:
+        st.error("Unable to export analyses right now.")
+        return
+    conn = get_db_connection(readonly=True)
+    if not conn:
+        st.error("Unable to export analyses right now.")
+        return
+    try:
+        total = count_customer_analyses(conn, customer_id)
+        conn.rollback()
+    except Exception as e:
+        logging.error(f"Error counting analyses for {customer_id}: {e}")
+        st.error("Unable to export analyses right now.")
+        conn.close()
+        return
+    if total > EXPORT_UI_MAX_ROWS:
+        conn.close()
+        show_export_too_large(customer_id, f"{total} analyses")
+        return
+    progress = st.progress(0.0, text="Exporting...")
+
+    def report(written, total, elapsed):
+        rate = written / elapsed if elapsed else 0
+        progress.progress(min(1.0, written / total) if total else 1.0, text=f"{written}/{total} analyses, {rate:.0f} rows/s")
+
+    # Rows are streamed to disk in batches, then handed to the download button
+    # once. The file is removed straight away, finished or not, and the button
+    # is only rendered on this run, so later menu reruns don't re-read it.
+    out = tempfile.NamedTemporaryFile(delete=False, suffix=f".{export_format}")
+    try:
+        with out:
+            rows = export_customer_analyses(conn, customer_id, out, export_format, progress=report)
+        size = os.path.getsize(out.name)
+        if size > EXPORT_UI_MAX_BYTES:
+            show_export_too_large(customer_id, f"{size / 1024 / 1024:.1f} MiB")
+            return
+        with open(out.name, "rb") as export_data:
+            st.download_button(
+                f"Download {rows} analyses",
+                export_data,
+                file_name=f"analyses.{export_format}",
+                key="export_download",
+                on_click="ignore"
+            )
+    except Exception as e:
+        logging.error(f"Error exporting analyses for {customer_id}: {e}")
+        st.error("Unable to export analyses right now.")
+    finally:
+        conn.close()
+        os.remove(out.name)
+
+def get_cached_entitlements(customer_id):
+    def load():
+        result = get_entitlements(customer_id)
+        # Errors are not cached so the next menu open retries
+        return result if result.get("status") == "success" else None
+    return get_cache().get(f"entitlements:{customer_id}", load, ENTITLEMENTS_CACHE_TTL_S)
+
 def display_sidebar():
     st.sidebar.header(st.session_state.sidebar_message)
-    
-    # Profile button at the very top
-    if st.sidebar.button("👤 Profile", key="profile_button"):
-        st.session_state.show_account_menu = not st.session_state.get('show_account_menu', False)
-    
-    # Show account menu if the profile button was clicked
-    if st.session_state.get('show_account_menu', False):
-        st.sidebar.subheader("Account Options")
-        if st.sidebar.button("Reset Password"):
-            st.session_state.page = "reset_password"
-            st.rerun()
-        if st.sidebar.button("   Logout  "):
-            # Reset all session state variables
-            st.session_state.page = "login"
-            st.session_state.login_success = False
-            st.session_state.conversation = []
-            st.session_state.uploaded_file = None
-            st.session_state.text = " "
-            st.session_state.Image_text = ""
-            st.session_state.sum = ""
-            st.session_state.content_generated = False
-            st.session_state.user_email = None
-            st.rerun()
-        if st.sidebar.button("  Close Menu  "):
-            st.session_state.show_account_menu = False
-            st.rerun()
-        customer_id = get_marketplace_customer_id(st.session_state.user_email)
+    with st.sidebar:
+        account_menu()
+
+def toggle_account_menu():
+    st.session_state.show_account_menu = not st.session_state.get('show_account_menu', False)
+
+def close_account_menu():
+    st.session_state.show_account_menu = False
+
+# Opening and closing the menu reruns only this fragment. The buttons flip the
+# flag in on_click callbacks, before the rerun, so no explicit st.rerun is needed
+# and the menu also works when the fragment renders as part of a full-app run.
+@st.fragment
+def account_menu():
+    with measure_render("account_menu"):
+        # Profile button at the very top
+        st.button("👤 Profile", key="profile_button", on_click=toggle_account_menu)
+
+        # Show account menu if the profile button was clicked
+        if st.session_state.get('show_account_menu', False):
+            st.subheader("Account Options")
+            if st.button("Reset Password"):
+                st.session_state.page = "reset_password"
+                st.rerun()
+            if st.button("   Logout  "):
+                # Reset all session state variables
+                st.session_state.page = "login"
+                st.session_state.login_success = False
+                st.session_state.conversation = []
+                st.session_state.uploaded_file = None
+                st.session_state.text = " "
+                st.session_state.Image_text = ""
+                st.session_state.sum = ""
+                st.session_state.content_generated = False
+                st.session_state.user_email = None
+                st.session_state.pop("analysis_job_id", None)
+                st.session_state.pop("customer_id", None)
+                st.session_state.pop("chat_context", None)
+                st.rerun()
+            st.button("  Close Menu  ", on_click=close_account_menu)
+
+            export_panel()
+
+            result = get_cached_entitlements(get_session_customer_id())
+
+            if result and result.get("status") == "success":
+                    date = result["entitlements"]["ResponseMetadata"]["HTTPHeaders"]["date"]
+                    st.subheader(f"Subscription ends on: {date}")
+            else:
+                    st.error("Unable to retrieve entitlements.")
 
-        result = get_entitlements(customer_id)
-        
-        if result and result["status"] == "success":
-                date = result["entitlements"]["ResponseMetadata"]["HTTPHeaders"]["date"]
-                st.sidebar.subheader(f"Subscription ends on: {date}")            
-        
-            
-        
-        else:
-                st.error("Unable to retrieve entitlements.")
 def main():
     if st.session_state.get('login_success'):
         set_wide_layout()
@@ -1003,6 +1591,9 @@ def main():
         unsafe_allow_html=True,
     )
     
+    start_analysis_workers()
+    register_health_stats()
+
     if st.session_state.page == "login":
         login_page()
     elif st.session_state.page == "reset_password":
@@ -1019,4 +1610,6 @@ def main():
     
 
 if __name__ == "__main__":
-    main()
+    # Full-script reruns are timed as "app"; fragments time themselves
+    with measure_render("app"):
+        main()
@@ -0,0 +1,70 @@
+import argparse
+import logging
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import password_hashing
+
+# Measures how many logins per second this node can sustain through the
+# password hashing pool. Run: python bench_auth.py --logins 200 --clients 16
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_benchmark(logins, clients):
+    stored = password_hashing.hash_password("Bench-Passw0rd!")
+    latencies = []
+
+    def login(_):
+        start = time.perf_counter()
+        matches, _ = password_hashing.verify_password("Bench-Passw0rd!", stored)
+        latencies.append(time.perf_counter() - start)
+        return matches
+
+    # Warm the worker processes before timing
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(login, range(password_hashing.PASSWORD_HASH_WORKERS)))
+    latencies.clear()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(login, range(logins)))
+    elapsed = time.perf_counter() - start
+
+    if not all(results):
+        raise RuntimeError("Benchmark password failed to verify")
+    return {
+        "logins": logins,
+        "clients": clients,
+        "workers": password_hashing.PASSWORD_HASH_WORKERS,
+        "scrypt_n": password_hashing.get_scrypt_n(),
+        "elapsed_s": elapsed,
+        "logins_per_s": logins / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Password hashing throughput benchmark")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=16)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    try:
+        stats = run_benchmark(args.logins, args.clients)
+    finally:
+        password_hashing.shutdown()
+    for name, value in stats.items():
+        print(f"{name:>14}: {value:.2f}" if isinstance(value, float) else f"{name:>14}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import statistics
+import time
+
+import psycopg2
+
+from db import PreparedConnection, fetchone_prepared
+
+# Compares the legacy multi-round-trip signup / password reset flows with the
+# prepared single-round-trip statements in db.py. The benchmark only touches
+# TEMP tables that shadow users/product_customers for its own session, so it
+# is safe to point at a shared database:
+#   python bench_db.py --dsn "host=... dbname=... user=... password=..." --iterations 500
+
+SCHEMA = """
+    CREATE TEMP TABLE product_customers (
+        id SERIAL PRIMARY KEY,
+        product_code VARCHAR(100) NOT NULL,
+        customer_id VARCHAR(100) UNIQUE NOT NULL,
+        customer_aws_account_id VARCHAR(100) NOT NULL
+    );
+    CREATE TEMP TABLE users (
+        id SERIAL PRIMARY KEY,
+        username VARCHAR(50) NOT NULL,
+        email VARCHAR(100) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        customer_id INTEGER UNIQUE REFERENCES product_customers(id)
+    );
+"""
+
+
+def setup(conn, iterations):
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA)
+        cur.execute("""
+            INSERT INTO product_customers (product_code, customer_id, customer_aws_account_id)
+            SELECT 'bench', 'bench-' || g, 'bench' FROM generate_series(1, %s) g
+        """, (iterations * 2,))
+    conn.commit()
+
+
+def legacy_signup(conn, username, email, password, customer_id):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT email FROM users WHERE email = %s", (email,))
+        if cur.fetchone():
+            return False
+        cur.execute("SELECT id FROM product_customers WHERE id = %s", (customer_id,))
+        if cur.fetchone() is None:
+            return False
+        cur.execute(
+            "INSERT INTO users (username, email, password, customer_id) VALUES (%s, %s, %s, %s)",
+            (username, email, password, customer_id)
+        )
+        conn.commit()
+        return True
+    finally:
+        cur.close()
+
+
+def legacy_reset(conn, email, password):
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT email FROM users WHERE email=%s", (email,))
+        if not cur.fetchone():
+            return False
+        cur.execute("UPDATE users SET password=%s WHERE email=%s", (password, email))
+        conn.commit()
+        return True
+    finally:
+        cur.close()
+
+
+def prepared_signup(conn, username, email, password, customer_id):
+    email_exists, customer_exists, user_id = fetchone_prepared(
+        conn, "signup_user", (username, email, password, customer_id)
+    )
+    return user_id is not None
+
+
+def prepared_reset(conn, email, password):
+    return fetchone_prepared(conn, "set_user_password", (password, email)) is not None
+
+
+def timed(label, fn, calls):
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        if not fn(*args):
+            raise RuntimeError(f"{label} failed for {args}")
+        latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+    print(f"{label:>18}: {len(calls) / total:8.1f} ops/s  "
+          f"p50 {statistics.median(latencies) * 1000:6.2f} ms  "
+          f"max {max(latencies) * 1000:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Signup / reset round-trip benchmark")
+    parser.add_argument("--dsn", required=True)
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    n = args.iterations
+    legacy_conn = psycopg2.connect(args.dsn)
+    prepared_conn = psycopg2.connect(args.dsn, connection_factory=PreparedConnection)
+    try:
+        setup(legacy_conn, n)
+        setup(prepared_conn, n)
+
+        signups = [(f"user{i}", f"user{i}@bench.local", "x" * 90, i + 1) for i in range(n)]
+        resets = [(f"user{i}@bench.local", "y" * 90) for i in range(n)]
+
+        timed("legacy signup", lambda *a: legacy_signup(legacy_conn, *a), signups)
+        timed("prepared signup", lambda *a: prepared_signup(prepared_conn, *a), signups)
+        timed("legacy reset", lambda *a: legacy_reset(legacy_conn, *a), resets)
+        timed("prepared reset", lambda *a: prepared_reset(prepared_conn, *a), resets)
+    finally:
+        legacy_conn.close()
+        prepared_conn.close()
+
+
+if __name__ == "__main__":
+    main()
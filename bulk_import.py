@@ -0,0 +1,302 @@
+import argparse
+import csv
+import io
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from password_hashing import UNUSABLE_PASSWORD
+
+logger = logging.getLogger(__name__)
+
+# Bulk onboarding of marketplace customers and their users from a CSV with the columns
+#   product_code, customer_id, customer_aws_account_id, username, email
+# Rows without username/email only provision the customer. Users are created
+# without a usable password and get a welcome email telling them to set one
+# with "Forgot Password".
+#   python bulk_import.py clinicians.csv --rejects rejected.csv
+
+REQUIRED_COLUMNS = ("product_code", "customer_id", "customer_aws_account_id", "username", "email")
+MAX_LENGTHS = {
+    "product_code": 100,
+    "customer_id": 100,
+    "customer_aws_account_id": 100,
+    "username": 50,
+    "email": 100,
+}
+
+CREATE_EMAIL_OUTBOX_SQL = """
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id BIGSERIAL PRIMARY KEY,
+        email VARCHAR(100) NOT NULL,
+        username VARCHAR(50) NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        queued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        sent_at TIMESTAMPTZ,
+        locked_until TIMESTAMPTZ
+    );
+    ALTER TABLE email_outbox ADD COLUMN IF NOT EXISTS locked_until TIMESTAMPTZ;
+    DROP INDEX IF EXISTS email_outbox_queued_idx;
+    CREATE INDEX IF NOT EXISTS email_outbox_pending_idx ON email_outbox (id) WHERE status IN ('queued', 'sending');
+"""
+
+STAGING_SQL = """
+    CREATE TEMP TABLE bulk_staging (
+        line_number INTEGER NOT NULL,
+        product_code VARCHAR(100) NOT NULL,
+        customer_id VARCHAR(100) NOT NULL,
+        customer_aws_account_id VARCHAR(100) NOT NULL,
+        username VARCHAR(50),
+        email VARCHAR(100),
+        password VARCHAR(255),
+        reject_reason TEXT
+    ) ON COMMIT DROP
+"""
+
+COPY_SQL = """
+    COPY bulk_staging (line_number, product_code, customer_id, customer_aws_account_id, username, email, password)
+    FROM STDIN WITH (FORMAT csv)
+"""
+
+MERGE_CUSTOMERS_SQL = """
+    INSERT INTO product_customers (product_code, customer_id, customer_aws_account_id)
+    SELECT DISTINCT ON (customer_id) product_code, customer_id, customer_aws_account_id
+    FROM bulk_staging
+    ORDER BY customer_id, line_number
+    ON CONFLICT (customer_id) DO NOTHING
+"""
+
+# users.email is UNIQUE and unique_customer_id allows one user per customer.
+# Emails are compared case-insensitively, as they are within the file.
+FLAG_EXISTING_EMAIL_SQL = """
+    UPDATE bulk_staging s SET reject_reason = 'email already exists'
+    WHERE s.email IS NOT NULL AND EXISTS (SELECT 1 FROM users u WHERE lower(u.email) = lower(s.email))
+"""
+
+FLAG_CUSTOMER_TAKEN_SQL = """
+    UPDATE bulk_staging s SET reject_reason = 'customer already has a user'
+    FROM product_customers pc
+    WHERE s.email IS NOT NULL AND s.reject_reason IS NULL
+      AND pc.customer_id = s.customer_id
+      AND EXISTS (SELECT 1 FROM users u WHERE u.customer_id = pc.id)
+"""
+
+MERGE_USERS_SQL = """
+    WITH inserted AS (
+        INSERT INTO users (username, email, password, customer_id)
+        SELECT s.username, s.email, s.password, pc.id
+        FROM bulk_staging s
+        JOIN product_customers pc ON pc.customer_id = s.customer_id
+        WHERE s.email IS NOT NULL AND s.reject_reason IS NULL
+        ON CONFLICT DO NOTHING
+        RETURNING email, username
+    ),
+    queued AS (
+        INSERT INTO email_outbox (email, username)
+        SELECT email, username FROM inserted
+        RETURNING email
+    )
+    UPDATE bulk_staging s SET reject_reason = 'conflicting concurrent signup'
+    WHERE s.email IS NOT NULL AND s.reject_reason IS NULL
+      AND s.email NOT IN (SELECT email FROM queued)
+"""
+
+REJECTED_SQL = """
+    SELECT line_number, email, reject_reason FROM bulk_staging
+    WHERE reject_reason IS NOT NULL
+    ORDER BY line_number
+"""
+
+USER_COUNT_SQL = "SELECT count(email) FILTER (WHERE reject_reason IS NULL) FROM bulk_staging"
+
+# Rows left in 'sending' by a sender that died are claimable again once their
+# lease runs out, the same way analysis_jobs are reclaimed
+CLAIM_EMAILS_SQL = """
+    UPDATE email_outbox
+    SET status = 'sending', attempts = attempts + 1,
+        locked_until = now() + make_interval(secs => %(lease_s)s)
+    WHERE id IN (
+        SELECT id FROM email_outbox
+        WHERE (status = 'queued' OR (status = 'sending' AND locked_until < now()))
+          AND attempts < %(max_attempts)s
+        ORDER BY id
+        FOR UPDATE SKIP LOCKED
+        LIMIT %(batch_size)s
+    )
+    RETURNING id, email, username, attempts
+"""
+
+EXPIRE_EMAILS_SQL = """
+    UPDATE email_outbox SET status = 'failed', locked_until = NULL
+    WHERE status = 'sending' AND locked_until < now() AND attempts >= %s
+"""
+
+MARK_SENT_SQL = "UPDATE email_outbox SET status = 'sent', sent_at = now(), locked_until = NULL WHERE id = ANY(%s)"
+MARK_RETRY_SQL = "UPDATE email_outbox SET status = 'queued', locked_until = NULL WHERE id = ANY(%s)"
+MARK_FAILED_SQL = "UPDATE email_outbox SET status = 'failed', locked_until = NULL WHERE id = ANY(%s)"
+
+
+def validate_rows(reader, is_valid_email):
+    # reader is a csv.DictReader. Returns (valid rows as dicts with line_number,
+    # rejected (line_number, email, reason)); line_number is the line the row ends
+    # on, which stays right when a quoted field spans several lines.
+    valid, rejected = [], []
+    seen_emails, customers_with_user = set(), set()
+    for row in reader:
+        line_number = reader.line_num
+        row = {column: (row.get(column) or "").strip() for column in REQUIRED_COLUMNS}
+        email = row["email"]
+        reason = None
+        if not row["product_code"] or not row["customer_id"] or not row["customer_aws_account_id"]:
+            reason = "missing customer fields"
+        elif bool(row["username"]) != bool(email):
+            reason = "username and email must both be set or both be empty"
+        elif email and not is_valid_email(email):
+            reason = "invalid email"
+        elif any(len(row[column]) > limit for column, limit in MAX_LENGTHS.items()):
+            reason = "value too long"
+        elif email and email.lower() in seen_emails:
+            reason = "duplicate email in file"
+        elif email and row["customer_id"] in customers_with_user:
+            reason = "customer already has a user in file"
+        if reason:
+            rejected.append((line_number, email, reason))
+            continue
+        if email:
+            seen_emails.add(email.lower())
+            customers_with_user.add(row["customer_id"])
+        row["line_number"] = line_number
+        valid.append(row)
+    return valid, rejected
+
+
+def _staging_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            row["line_number"],
+            row["product_code"],
+            row["customer_id"],
+            row["customer_aws_account_id"],
+            row["username"] or None,
+            row["email"] or None,
+            UNUSABLE_PASSWORD if row["email"] else None,
+        ])
+    buffer.seek(0)
+    return buffer
+
+
+def merge_rows(conn, rows):
+    # Stage with COPY and merge everything in a single transaction
+    with conn.cursor() as cur:
+        cur.execute(STAGING_SQL)
+        cur.copy_expert(COPY_SQL, _staging_csv(rows))
+        cur.execute(MERGE_CUSTOMERS_SQL)
+        # Only customers that did not exist yet; ON CONFLICT DO NOTHING rows don't count
+        customers = cur.rowcount
+        cur.execute(FLAG_EXISTING_EMAIL_SQL)
+        cur.execute(FLAG_CUSTOMER_TAKEN_SQL)
+        cur.execute(MERGE_USERS_SQL)
+        cur.execute(USER_COUNT_SQL)
+        users = cur.fetchone()[0]
+        cur.execute(REJECTED_SQL)
+        rejected = cur.fetchall()
+    conn.commit()
+    return customers, users, rejected
+
+
+def send_queued_welcome_emails(connection, send_welcome_email, batch_size=50, max_attempts=3,
+                               per_second=10, threads=4, lease_s=300):
+    # Drains email_outbox in batches, throttled to stay under the SES send rate.
+    # lease_s must comfortably exceed the time it takes to send one batch.
+    sent = failed = 0
+    while True:
+        with connection() as conn, conn.cursor() as cur:
+            cur.execute(EXPIRE_EMAILS_SQL, (max_attempts,))
+            cur.execute(CLAIM_EMAILS_SQL, {"lease_s": lease_s, "max_attempts": max_attempts, "batch_size": batch_size})
+            batch = cur.fetchall()
+            conn.commit()
+        if not batch:
+            return sent, failed
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(lambda item: send_welcome_email(item[1], item[2]), batch))
+
+        ok = [item[0] for item, result in zip(batch, results) if result]
+        retry = [item[0] for item, result in zip(batch, results) if not result and item[3] < max_attempts]
+        dead = [item[0] for item, result in zip(batch, results) if not result and item[3] >= max_attempts]
+        with connection() as conn, conn.cursor() as cur:
+            for sql, ids in ((MARK_SENT_SQL, ok), (MARK_RETRY_SQL, retry), (MARK_FAILED_SQL, dead)):
+                if ids:
+                    cur.execute(sql, (ids,))
+            conn.commit()
+        sent += len(ok)
+        failed += len(dead)
+        logger.info(f"Welcome emails: {len(ok)} sent, {len(retry)} to retry, {len(dead)} failed in this batch")
+
+        remaining = len(batch) / per_second - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+        if retry and not ok:
+            # Nothing is getting through; leave the rest for the next run
+            return sent, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk provision marketplace customers and users")
+    parser.add_argument("csv_file")
+    parser.add_argument("--rejects", help="Write rejected rows to this CSV file")
+    parser.add_argument("--no-emails", action="store_true", help="Queue welcome emails without sending them")
+    parser.add_argument("--email-batch-size", type=int, default=50)
+    parser.add_argument("--email-rate", type=float, default=10, help="Welcome emails per second")
+    args = parser.parse_args()
+
+    # Loads the secrets, database settings and email sender from the app
+    import app
+
+    with open(args.csv_file, newline="", encoding="utf-8-sig") as source:
+        reader = csv.DictReader(source)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            sys.exit(f"Missing columns: {', '.join(missing)}")
+        rows, rejected = validate_rows(reader, app.is_valid_email)
+
+    conn = app.get_db_connection()
+    if not conn:
+        sys.exit("Unable to connect to the database")
+    try:
+        customers, users, merge_rejected = merge_rows(conn, rows)
+    except Exception as e:
+        conn.rollback()
+        sys.exit(f"Import failed, nothing was written: {e}")
+    finally:
+        conn.close()
+
+    rejected = sorted(rejected + list(merge_rejected))
+    print(f"{customers} new customers, {users} users created, {len(rejected)} rows rejected")
+    if args.rejects:
+        with open(args.rejects, "w", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(["line_number", "email", "reason"])
+            writer.writerows(rejected)
+    else:
+        for line_number, email, reason in rejected:
+            print(f"  line {line_number}: {email or '-'}: {reason}")
+
+    if not args.no_emails:
+        sent, failed = send_queued_welcome_emails(
+            app.get_db_router().connection,
+            partial(app.send_welcome_email, imported=True),
+            batch_size=args.email_batch_size,
+            per_second=args.email_rate,
+        )
+        print(f"{sent} welcome emails sent, {failed} failed")
+
+
+if __name__ == "__main__":
+    main()
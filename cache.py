@@ -0,0 +1,255 @@
+import json
+import logging
+import select
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Two-tier cache for memoized lookups shared by every app replica: an
+# in-process LRU in front of a shared back tier. Writes invalidate both tiers
+# and broadcast the keys so other replicas drop their front-tier copies.
+# Values must be JSON-serializable; None is never cached.
+
+CREATE_CACHE_TABLE_SQL = """
+    CREATE UNLOGGED TABLE IF NOT EXISTS shared_cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        expires_at TIMESTAMPTZ NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS shared_cache_expires_idx ON shared_cache (expires_at);
+"""
+
+GET_SQL = "SELECT value, EXTRACT(EPOCH FROM expires_at - now()) FROM shared_cache WHERE key = %s AND expires_at > now()"
+
+SET_SQL = """
+    INSERT INTO shared_cache (key, value, expires_at)
+    VALUES (%s, %s, now() + make_interval(secs => %s))
+    ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+"""
+
+# Delete and notify in one round trip; NOTIFY is delivered on commit
+INVALIDATE_SQL = """
+    WITH deleted AS (DELETE FROM shared_cache WHERE key = ANY(%(keys)s))
+    SELECT pg_notify(%(channel)s, key) FROM unnest(%(keys)s::text[]) AS key
+"""
+
+PURGE_SQL = "DELETE FROM shared_cache WHERE expires_at < now()"
+
+
+class LocalBackend:
+    # In-process stand-in for the shared tier, for a single node or local development
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._subscribers = []
+
+    def get(self, key):
+        with self._lock:
+            item = self._values.get(key)
+        if item is None or item[1] <= time.monotonic():
+            return None
+        return item[0], item[1] - time.monotonic()
+
+    def set(self, key, value, ttl_s):
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl_s)
+
+    def invalidate(self, keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(keys)
+
+    def listen(self, on_invalidate, on_reset):
+        with self._lock:
+            self._subscribers.append(on_invalidate)
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            self._values = {k: v for k, v in self._values.items() if v[1] > now}
+
+
+class PostgresBackend:
+    # Shared tier in an UNLOGGED table: no WAL, so writes are cheap and the
+    # contents are lost on a crash, which is fine for a cache. Invalidations are
+    # broadcast with NOTIFY and received on a dedicated LISTEN connection.
+    # get_pool is called on each use, so a database that is down when the cache
+    # is created only costs failed lookups, which the cache treats as misses.
+
+    def __init__(self, get_pool, connect, channel="shared_cache_invalidation", reconnect_delay_s=5.0):
+        self.get_pool = get_pool
+        self.connect = connect
+        self.channel = channel
+        self.reconnect_delay_s = reconnect_delay_s
+        self._stop = threading.Event()
+
+    def create_table(self):
+        with self.get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute(CREATE_CACHE_TABLE_SQL)
+            conn.commit()
+
+    def get(self, key):
+        with self.get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute(GET_SQL, (key,))
+            row = cur.fetchone()
+        return (row[0], float(row[1])) if row else None
+
+    def set(self, key, value, ttl_s):
+        with self.get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute(SET_SQL, (key, value, ttl_s))
+            conn.commit()
+
+    def invalidate(self, keys):
+        with self.get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute(INVALIDATE_SQL, {"keys": list(keys), "channel": self.channel})
+            conn.commit()
+
+    def purge_expired(self):
+        with self.get_pool().connection() as conn, conn.cursor() as cur:
+            cur.execute(PURGE_SQL)
+            conn.commit()
+
+    def listen(self, on_invalidate, on_reset):
+        thread = threading.Thread(
+            target=self._listen, args=(on_invalidate, on_reset), name="cache-invalidation", daemon=True
+        )
+        thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _listen(self, on_invalidate, on_reset):
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self.connect()
+                if conn is None:
+                    raise RuntimeError("no database connection")
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f'LISTEN "{self.channel}"')
+                # Notifications sent while we were disconnected are lost
+                on_reset()
+                logger.info(f"Listening for cache invalidations on {self.channel}")
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    keys = [notify.payload for notify in conn.notifies]
+                    conn.notifies.clear()
+                    if keys:
+                        on_invalidate(keys)
+            except Exception as e:
+                logger.error(f"Cache invalidation listener failed, reconnecting: {e}")
+                self._stop.wait(self.reconnect_delay_s)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+class TwoTierCache:
+    def __init__(self, back=None, front_size=1024, front_ttl_s=60.0, purge_interval_s=600.0):
+        # front_ttl_s caps how long a replica serves its own copy if an invalidation is missed
+        self.back = back
+        self.front_size = front_size
+        self.front_ttl_s = front_ttl_s
+        self.purge_interval_s = purge_interval_s
+        self._lock = threading.Lock()
+        self._front = OrderedDict()
+        self._purged_at = time.monotonic()
+        self._hits = {"front": 0, "back": 0, "miss": 0}
+
+    def start(self):
+        if self.back is not None:
+            self.back.listen(self._drop, self.clear_front)
+        return self
+
+    def _front_get(self, key):
+        with self._lock:
+            item = self._front.get(key)
+            if item is None:
+                return None
+            if item[1] <= time.monotonic():
+                del self._front[key]
+                return None
+            self._front.move_to_end(key)
+            return item
+
+    def _front_set(self, key, value, ttl_s):
+        with self._lock:
+            self._front[key] = (value, time.monotonic() + min(ttl_s, self.front_ttl_s))
+            self._front.move_to_end(key)
+            while len(self._front) > self.front_size:
+                self._front.popitem(last=False)
+
+    def _drop(self, keys):
+        with self._lock:
+            for key in keys:
+                self._front.pop(key, None)
+
+    def clear_front(self):
+        with self._lock:
+            self._front.clear()
+
+    def _count(self, tier):
+        with self._lock:
+            self._hits[tier] += 1
+
+    def get(self, key, loader, ttl_s, shared=True):
+        # shared=False keeps the value in this process only (e.g. anything secret)
+        item = self._front_get(key)
+        if item is not None:
+            self._count("front")
+            return item[0]
+
+        if shared and self.back is not None:
+            try:
+                stored = self.back.get(key)
+            except Exception as e:
+                logger.warning(f"Shared cache read failed for {key}: {e}")
+                stored = None
+            if stored is not None:
+                value = json.loads(stored[0])
+                self._front_set(key, value, stored[1])
+                self._count("back")
+                return value
+
+        self._count("miss")
+        value = loader()
+        if value is None:
+            return None
+        self._front_set(key, value, ttl_s)
+        if shared and self.back is not None:
+            try:
+                self.back.set(key, json.dumps(value, default=str), ttl_s)
+                self._maybe_purge()
+            except Exception as e:
+                logger.warning(f"Shared cache write failed for {key}: {e}")
+        return value
+
+    def invalidate(self, *keys):
+        self._drop(keys)
+        if self.back is not None:
+            try:
+                self.back.invalidate(keys)
+            except Exception as e:
+                # Other replicas still expire their copies after front_ttl_s
+                logger.error(f"Shared cache invalidation failed for {keys}: {e}")
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._purged_at < self.purge_interval_s:
+                return
+            self._purged_at = now
+        self.back.purge_expired()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._hits, front_size=len(self._front))
@@ -0,0 +1,104 @@
+import math
+import os
+import re
+
+# The chat payload carries the analysis_id plus a bounded context window: the
+# most recent turns verbatim and a rolling summary of everything older, so its
+# size stays flat however long the conversation runs.
+RECENT_TOKEN_BUDGET = int(os.getenv("CHAT_RECENT_TOKEN_BUDGET", "800"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("CHAT_SUMMARY_TOKEN_BUDGET", "300"))
+MAX_RECENT_TURNS = int(os.getenv("CHAT_MAX_RECENT_TURNS", "4"))
+MAX_MESSAGE_CHARS = 1500
+SUMMARY_QUESTION_CHARS = 120
+SUMMARY_ANSWER_CHARS = 200
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return math.ceil(len(text) / 4)
+
+
+def _clip(text, limit):
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[:limit - 1].rstrip() + "…"
+
+
+def _gist(text, limit):
+    # First sentence, clipped; answers usually lead with the finding
+    text = " ".join(text.split())
+    return _clip(_SENTENCE_END.split(text, maxsplit=1)[0], limit)
+
+
+def conversation_turns(conversation):
+    # session_state.conversation is newest first: [user, assistant, user, assistant, ...]
+    turns = []
+    for i in range(0, len(conversation) - 1, 2):
+        turns.append((conversation[i]["content"], conversation[i + 1]["content"]))
+    turns.reverse()
+    return turns
+
+
+def new_state():
+    return {"summary_lines": [], "folded": 0, "dropped": 0}
+
+
+def _fold(state, turns):
+    # Incrementally add turns to the summary, trimming the oldest lines to stay in budget
+    lines = state["summary_lines"]
+    for question, answer in turns:
+        lines.append(f"Q: {_gist(question, SUMMARY_QUESTION_CHARS)} A: {_gist(answer, SUMMARY_ANSWER_CHARS)}")
+    state["folded"] += len(turns)
+    while lines and estimate_tokens("\n".join(lines)) > SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+        state["dropped"] += 1
+
+
+def _summary_text(state):
+    lines = state["summary_lines"]
+    if not lines:
+        return ""
+    prefix = [f"({state['dropped']} earlier exchanges omitted)"] if state["dropped"] else []
+    return "\n".join(prefix + lines)
+
+
+def build_context(turns, state):
+    # Pick the recent turns that fit the budget, newest first
+    recent = []
+    used = 0
+    for question, answer in reversed(turns[state["folded"]:]):
+        question = _clip(question, MAX_MESSAGE_CHARS)
+        answer = _clip(answer, MAX_MESSAGE_CHARS)
+        cost = estimate_tokens(question) + estimate_tokens(answer)
+        if len(recent) >= MAX_RECENT_TURNS or (recent and used + cost > RECENT_TOKEN_BUDGET):
+            break
+        recent.append((question, answer))
+        used += cost
+    recent.reverse()
+
+    # Everything older than the window is folded into the summary exactly once
+    unfolded = turns[state["folded"]:len(turns) - len(recent)]
+    if unfolded:
+        _fold(state, unfolded)
+
+    messages = []
+    for question, answer in recent:
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "assistant", "content": answer})
+    return {"summary": _summary_text(state), "recent_turns": messages}
+
+
+def build_payload(user_message, analysis_id, conversation, state):
+    turns = conversation_turns(conversation)
+    if state["folded"] > len(turns):
+        # The conversation was cleared (e.g. logout); start over
+        state.clear()
+        state.update(new_state())
+    return {
+        "user_message": user_message,
+        "analysis_id": analysis_id,
+        "context": build_context(turns, state),
+    }
@@ -0,0 +1,247 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Hot queries, prepared once per pooled connection and then run with EXECUTE.
+# Each entry is (parameter types, statement body).
+PREPARED_STATEMENTS = {
+    # One round trip signup: reports whether the email already existed and
+    # whether the product customer exists, and inserts only when both checks pass.
+    "signup_user": (
+        ("text", "text", "text", "integer"),
+        """
+        WITH existing AS (
+            SELECT 1 FROM users WHERE email = $2
+        ),
+        customer AS (
+            SELECT id FROM product_customers WHERE id = $4
+        ),
+        inserted AS (
+            INSERT INTO users (username, email, password, customer_id)
+            SELECT $1, $2, $3, customer.id FROM customer
+            WHERE NOT EXISTS (SELECT 1 FROM existing)
+            ON CONFLICT (email) DO NOTHING
+            RETURNING id
+        )
+        SELECT EXISTS (SELECT 1 FROM existing),
+               EXISTS (SELECT 1 FROM customer),
+               (SELECT id FROM inserted)
+        """,
+    ),
+    "set_user_password": (
+        ("text", "text"),
+        "UPDATE users SET password = $1 WHERE email = $2 RETURNING email",
+    ),
+    "rehash_user_password": (
+        ("text", "text", "text"),
+        "UPDATE users SET password = $1 WHERE email = $2 AND password = $3 RETURNING email",
+    ),
+    "get_user_credentials": (
+        ("text",),
+        "SELECT email, password FROM users WHERE email = $1",
+    ),
+    "get_user_name": (
+        ("text",),
+        "SELECT username FROM users WHERE email = $1",
+    ),
+    "get_marketplace_customer_id": (
+        ("text",),
+        """
+        SELECT u.customer_id, pc.customer_id
+        FROM users u
+        LEFT JOIN product_customers pc ON pc.id = u.customer_id
+        WHERE u.email = $1
+        """,
+    ),
+    "table_exists": (
+        ("text",),
+        "SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = $1)",
+    ),
+    "column_exists": (
+        ("text", "text"),
+        "SELECT EXISTS (SELECT FROM information_schema.columns WHERE table_name = $1 AND column_name = $2)",
+    ),
+}
+
+# Seconds the replica is behind; 0 when it has replayed everything it received
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PreparedConnection(psycopg2.extensions.connection):
+    # Autocommit so a single EXECUTE is a single round trip (no BEGIN/COMMIT),
+    # and remembers which statements this server session has prepared.
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.autocommit = True
+        self.prepared = set()
+
+
+def execute_prepared(cur, name, params):
+    types, body = PREPARED_STATEMENTS[name]
+    placeholders = ", ".join(["%s"] * len(params))
+    execute = f"EXECUTE {name} ({placeholders})" if params else f"EXECUTE {name}"
+    prepared = cur.connection.prepared
+    if name in prepared:
+        cur.execute(execute, params)
+    else:
+        # PREPARE and the first EXECUTE travel together in one simple query
+        cur.execute(f"PREPARE {name} ({', '.join(types)}) AS {body}; {execute}", params)
+        prepared.add(name)
+
+
+def fetchone_prepared(conn, name, params):
+    with conn.cursor() as cur:
+        execute_prepared(cur, name, params)
+        return cur.fetchone()
+
+
+class ConnectionPool:
+    def __init__(self, minconn, maxconn, acquire_timeout=10.0, **connect_kwargs):
+        self.acquire_timeout = acquire_timeout
+        self._pool = ThreadedConnectionPool(
+            minconn, maxconn, connection_factory=PreparedConnection, **connect_kwargs
+        )
+        # ThreadedConnectionPool raises when exhausted; block up to acquire_timeout instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+
+    @contextmanager
+    def connection(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise PoolTimeout(f"No database connection available after {self.acquire_timeout} s")
+        try:
+            conn = self._pool.getconn()
+            try:
+                yield conn
+            except Exception:
+                # The server session state (prepared statements, transaction) is unknown now
+                self._pool.putconn(conn, close=True)
+                raise
+            else:
+                self._pool.putconn(conn, close=bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class ReadRouter:
+    # Sends read-only statements to the reader pool and everything else to the
+    # primary. Reads fall back to the primary when the replica is down or
+    # lagging, and reads for a key (the user's email) stick to the primary for
+    # sticky_s after that key was written so users always see their own writes.
+    # With make_reader the reader pool is built on first use, and a failed build
+    # is retried after down_backoff_s like any other replica outage.
+
+    def __init__(self, primary, reader=None, max_lag_s=5.0, sticky_s=30.0,
+                 lag_check_interval_s=5.0, down_backoff_s=30.0, make_reader=None):
+        self.primary = primary
+        self.reader = reader
+        self.make_reader = make_reader
+        self.max_lag_s = max_lag_s
+        self.sticky_s = sticky_s
+        self.lag_check_interval_s = lag_check_interval_s
+        self.down_backoff_s = down_backoff_s
+        self._lock = threading.Lock()
+        self._lag_lock = threading.Lock()
+        self._reader_lock = threading.Lock()
+        self._sticky = {}
+        self._reader_down_until = 0.0
+        self._lag_checked_at = 0.0
+        self._lag = 0.0
+
+    def mark_written(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._sticky[key] = now + self.sticky_s
+            # Drop expired entries so the map stays bounded
+            if len(self._sticky) > 10000:
+                self._sticky = {k: v for k, v in self._sticky.items() if v > now}
+
+    def _is_sticky(self, key):
+        expires = self._sticky.get(key)
+        return expires is not None and expires > time.monotonic()
+
+    def _mark_reader_down(self, error):
+        logger.error(f"Read replica unavailable, using the primary: {error}")
+        with self._lock:
+            self._reader_down_until = time.monotonic() + self.down_backoff_s
+
+    @property
+    def has_reader(self):
+        return self.reader is not None or self.make_reader is not None
+
+    def get_reader(self):
+        # The reader pool, or None while there is none or it is backing off
+        if self.reader is not None or self.make_reader is None:
+            return self.reader
+        if time.monotonic() < self._reader_down_until:
+            return None
+        with self._reader_lock:
+            if self.reader is None and time.monotonic() >= self._reader_down_until:
+                try:
+                    self.reader = self.make_reader()
+                    logger.info("Connected to the read replica")
+                except (psycopg2.OperationalError, PoolTimeout) as e:
+                    self._mark_reader_down(e)
+        return self.reader
+
+    def _reader_usable(self):
+        now = time.monotonic()
+        if now < self._reader_down_until or self.get_reader() is None:
+            return False
+        # Only one thread refreshes the lag; the rest use the last reading
+        if now - self._lag_checked_at >= self.lag_check_interval_s and self._lag_lock.acquire(blocking=False):
+            try:
+                self._lag_checked_at = now
+                with self.reader.connection() as conn, conn.cursor() as cur:
+                    cur.execute(REPLICA_LAG_SQL)
+                    self._lag = float(cur.fetchone()[0] or 0)
+                if self._lag > self.max_lag_s:
+                    logger.warning(f"Read replica is {self._lag:.1f} s behind, using the primary")
+            except (psycopg2.OperationalError, PoolTimeout) as e:
+                self._reader_down_until = now + self.down_backoff_s
+                logger.error(f"Read replica unavailable, using the primary: {e}")
+                return False
+            finally:
+                self._lag_lock.release()
+        return self._lag <= self.max_lag_s
+
+    def connection(self):
+        return self.primary.connection()
+
+    def fetchone(self, name, params, readonly=False, key=None):
+        if readonly and self.has_reader and not (key and self._is_sticky(key)) and self._reader_usable():
+            try:
+                with self.reader.connection() as conn:
+                    return fetchone_prepared(conn, name, params)
+            except (psycopg2.OperationalError, psycopg2.extensions.TransactionRollbackError, PoolTimeout) as e:
+                # Covers a dead replica and queries cancelled by recovery conflicts
+                self._mark_reader_down(e)
+
+        with self.primary.connection() as conn:
+            result = fetchone_prepared(conn, name, params)
+        if not readonly and key:
+            self.mark_written(key)
+        return result
+
+    def closeall(self):
+        self.primary.closeall()
+        if self.reader is not None:
+            self.reader.closeall()
@@ -0,0 +1,147 @@
+import argparse
+import csv
+import io
+import logging
+import sys
+import time
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Completed analyses for one marketplace customer, streamed with a server-side
+# cursor in fixed-size batches so memory use does not depend on the row count.
+EXPORT_COLUMNS = ["job_id", "analysis_id", "user_email", "customer_id", "enqueued_at", "finished_at", "result"]
+
+EXPORT_SQL = """
+    SELECT id, analysis_id, user_email, customer_id, enqueued_at, finished_at, result
+    FROM analysis_jobs
+    WHERE customer_id = %s AND status = 'done'
+    ORDER BY id
+"""
+
+COUNT_SQL = "SELECT count(*) FROM analysis_jobs WHERE customer_id = %s AND status = 'done'"
+
+FORMATS = ("csv", "parquet")
+
+
+class _CsvWriter:
+    def __init__(self, out):
+        self._text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._text.flush()
+        # Leave the underlying stream open for the caller
+        self._text.detach()
+
+
+class _ParquetWriter:
+    def __init__(self, out):
+        if pa is None:
+            raise RuntimeError("Parquet export requires pyarrow")
+        self._schema = pa.schema([
+            ("job_id", pa.int64()),
+            ("analysis_id", pa.string()),
+            ("user_email", pa.string()),
+            ("customer_id", pa.string()),
+            ("enqueued_at", pa.timestamp("us", tz="UTC")),
+            ("finished_at", pa.timestamp("us", tz="UTC")),
+            ("result", pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(out, self._schema, compression="zstd")
+
+    def write(self, rows):
+        # One row group per batch
+        columns = list(zip(*rows))
+        self._writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, self._schema)],
+            schema=self._schema,
+        ))
+
+    def close(self):
+        self._writer.close()
+
+
+def count_customer_analyses(conn, customer_id):
+    with conn.cursor() as cur:
+        cur.execute(COUNT_SQL, (customer_id,))
+        return cur.fetchone()[0]
+
+
+def export_customer_analyses(conn, customer_id, out, fmt="csv", batch_size=1000, progress=None):
+    # out is a binary file-like object; progress(rows_written, total_rows, elapsed_s) is called per batch
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    started = time.perf_counter()
+    total = count_customer_analyses(conn, customer_id)
+
+    writer = _ParquetWriter(out) if fmt == "parquet" else _CsvWriter(out)
+    written = 0
+    try:
+        # Named cursors are server-side: only batch_size rows are held client-side at a time
+        with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cur:
+            cur.itersize = batch_size
+            cur.execute(EXPORT_SQL, (customer_id,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                writer.write(rows)
+                written += len(rows)
+                if progress:
+                    progress(written, total, time.perf_counter() - started)
+    finally:
+        writer.close()
+        conn.rollback()
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Exported {written} analyses for customer {customer_id} as {fmt} in {elapsed:.1f} s "
+        f"({written / elapsed if elapsed else 0:.0f} rows/s)"
+    )
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a marketplace customer's analyses")
+    parser.add_argument("--customer-id", required=True, help="Marketplace customer id")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--output", default="-", help="Output file, or - for stdout")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    # Loads the secrets and database settings from the app
+    import app
+
+    def report(written, total, elapsed):
+        rate = written / elapsed if elapsed else 0
+        print(f"\r{written}/{total} rows, {rate:.0f} rows/s", end="", file=sys.stderr, flush=True)
+
+    conn = app.get_db_connection(readonly=True)
+    if not conn:
+        sys.exit("Unable to connect to the database")
+    try:
+        if args.output == "-":
+            export_customer_analyses(conn, args.customer_id, sys.stdout.buffer, args.format, args.batch_size, report)
+        else:
+            with open(args.output, "wb") as out:
+                export_customer_analyses(conn, args.customer_id, out, args.format, args.batch_size, report)
+        print(file=sys.stderr)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class _Probe:
+    def __init__(self, name, check, ttl_s, critical):
+        self.name = name
+        self.check = check
+        self.ttl_s = ttl_s
+        self.critical = critical
+        self.lock = threading.Lock()
+        self.result = None
+        self.checked_at = 0.0
+        self.thread = None
+        self.refreshing = False
+
+
+_current = None
+
+
+def current():
+    # The checker served by this process, if any
+    return _current
+
+
+_PENDING = {"status": "pending", "error": "first check still running"}
+
+
+class HealthChecker:
+    # Dependency probes whose results are cached for ttl_s. However often the
+    # load balancer polls, each dependency is probed at most once per ttl, in
+    # the background; requests only ever read the last results.
+
+    def __init__(self, timeout_s=3.0):
+        self.timeout_s = timeout_s
+        self.started_at = time.time()
+        self._probes = []
+        self._stats = {}
+
+    def add_probe(self, name, check, ttl_s=15.0, critical=True):
+        # check() raises on failure and may return a dict of extra details
+        self._probes.append(_Probe(name, check, ttl_s, critical))
+
+    def add_stats(self, name, collect):
+        # In-process counters reported alongside the probes; must not touch dependencies
+        self._stats[name] = collect
+
+    def _run(self, probe):
+        if probe.thread is not None and probe.thread.is_alive():
+            # A hung check keeps its own thread; don't stack another one behind it
+            return {"status": "timeout", "error": "previous check still running", "checked_at": time.time()}
+
+        started = time.perf_counter()
+        outcome = {}
+
+        def check():
+            try:
+                outcome["details"] = probe.check()
+            except Exception as e:
+                outcome["error"] = e
+
+        # A fresh thread per check, so one hung dependency cannot delay the other probes
+        probe.thread = threading.Thread(target=check, name=f"health-probe-{probe.name}", daemon=True)
+        probe.thread.start()
+        probe.thread.join(self.timeout_s)
+        if probe.thread.is_alive():
+            result = {"status": "timeout", "error": f"no response within {self.timeout_s} s"}
+        elif "error" in outcome:
+            result = {"status": "error", "error": str(outcome["error"])}
+        else:
+            result = {"status": "ok"}
+            if outcome.get("details"):
+                result["details"] = outcome["details"]
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["checked_at"] = time.time()
+        if result["status"] != "ok":
+            logger.warning(f"Health probe {probe.name} {result['status']}: {result.get('error')}")
+        return result
+
+    def _update(self, probe):
+        result = None
+        try:
+            result = self._run(probe)
+        finally:
+            with probe.lock:
+                if result is not None:
+                    probe.result = result
+                    probe.checked_at = time.monotonic()
+                probe.refreshing = False
+
+    def _refresh(self, probe):
+        # Starts a background refresh of a stale probe unless one is already running
+        with probe.lock:
+            fresh = probe.result is not None and time.monotonic() - probe.checked_at < probe.ttl_s
+            if fresh or probe.refreshing:
+                return
+            probe.refreshing = True
+        threading.Thread(
+            target=self._update, args=(probe,), name=f"health-refresh-{probe.name}", daemon=True
+        ).start()
+
+    def refresh(self):
+        # All stale probes are refreshed concurrently, so a slow one delays no other
+        for probe in self._probes:
+            self._refresh(probe)
+
+    def _result(self, probe):
+        self._refresh(probe)
+        with probe.lock:
+            return probe.result or _PENDING
+
+    def liveness(self):
+        # The process is serving requests; dependencies are not consulted
+        return True, {"status": "ok", "uptime_s": round(time.time() - self.started_at)}
+
+    def readiness(self):
+        # Never waits on a probe: until a probe's first check finishes it reports
+        # "pending", which keeps a critical probe's node out of rotation
+        checks = {}
+        ready = True
+        for probe in self._probes:
+            result = dict(self._result(probe), critical=probe.critical)
+            checks[probe.name] = result
+            if probe.critical and result["status"] != "ok":
+                ready = False
+        body = {"status": "ok" if ready else "unavailable", "checks": checks}
+        stats = {}
+        for name, collect in self._stats.items():
+            try:
+                stats[name] = collect()
+            except Exception as e:
+                stats[name] = {"error": str(e)}
+        if stats:
+            body["stats"] = stats
+        return ready, body
+
+
+def _handler(checker):
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?", 1)[0]
+            if path == "/livez":
+                ok, body = checker.liveness()
+            elif path == "/readyz":
+                ok, body = checker.readiness()
+            else:
+                self.send_error(404)
+                return
+            payload = json.dumps(body, default=str).encode()
+            self.send_response(200 if ok else 503)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Cache-Control", "no-store")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logger.debug(f"Health check {self.address_string()}: {format % args}")
+
+    return HealthHandler
+
+
+def serve(checker, port, host="0.0.0.0"):
+    # Runs /livez and /readyz next to Streamlit, on its own port, in a daemon thread
+    global _current
+    server = ThreadingHTTPServer((host, port), _handler(checker))
+    _current = checker
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="health-server", daemon=True)
+    thread.start()
+    # Have results ready by the load balancer's first poll
+    checker.refresh()
+    logger.info(f"Health endpoints listening on {host}:{port} (/livez, /readyz)")
+    return server
@@ -0,0 +1,160 @@
+import io
+import logging
+import os
+import threading
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from process_pool import new_process_pool
+
+logger = logging.getLogger(__name__)
+
+# Scanned pages are normalised to what OCR needs: grayscale at OCR_DPI for an
+# A4/Letter sized page, straightened, cropped to the content and recompressed.
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+PAGE_LONG_EDGE_IN = 11.7
+JPEG_QUALITY = int(os.getenv("SCAN_JPEG_QUALITY", "70"))
+MAX_SKEW_DEGREES = 5.0
+SKEW_STEP_DEGREES = 0.25
+ANALYSIS_SIZE = 800
+CROP_MARGIN_PX = 20
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+_lock = threading.Lock()
+_pool = None
+
+
+def _otsu_threshold(pixels):
+    histogram = np.bincount(pixels.ravel(), minlength=256).astype(np.float64)
+    total = pixels.size
+    cumulative = np.cumsum(histogram)
+    cumulative_mean = np.cumsum(histogram * np.arange(256))
+    background = cumulative[:-1]
+    foreground = total - background
+    valid = (background > 0) & (foreground > 0)
+    mean_background = np.where(valid, cumulative_mean[:-1] / np.maximum(background, 1), 0)
+    mean_foreground = np.where(
+        valid, (cumulative_mean[-1] - cumulative_mean[:-1]) / np.maximum(foreground, 1), 0
+    )
+    between = background * foreground * (mean_background - mean_foreground) ** 2
+    return int(np.argmax(np.where(valid, between, 0)))
+
+
+def _estimate_skew(gray):
+    # Projection profile: text rows give the sharpest row-sum histogram when level
+    small = gray.copy()
+    small.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    pixels = np.asarray(small)
+    ink = Image.fromarray(((pixels < _otsu_threshold(pixels)) * 255).astype(np.uint8))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + SKEW_STEP_DEGREES, SKEW_STEP_DEGREES):
+        rows = np.asarray(ink.rotate(float(angle), resample=Image.NEAREST)).sum(axis=1, dtype=np.float64)
+        score = float(np.var(rows))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def _bounds(mask):
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return cols[0], rows[0], cols[-1] + 1, rows[-1] + 1
+
+
+def _crop_to_content(gray):
+    pixels = np.asarray(gray)
+    threshold = _otsu_threshold(pixels)
+    paper = pixels >= threshold
+
+    # First drop the table/background around the sheet: rows and columns that are mostly not paper
+    rows = np.flatnonzero(paper.mean(axis=1) > 0.5)
+    cols = np.flatnonzero(paper.mean(axis=0) > 0.5)
+    if rows.size and cols.size:
+        pixels = pixels[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+        offset_x, offset_y = cols[0], rows[0]
+    else:
+        offset_x, offset_y = 0, 0
+
+    # Then trim the blank margins around the printed content
+    bounds = _bounds(pixels < threshold)
+    if bounds is None:
+        return gray
+    left, top, right, bottom = bounds
+    return gray.crop((
+        max(0, offset_x + left - CROP_MARGIN_PX),
+        max(0, offset_y + top - CROP_MARGIN_PX),
+        min(gray.width, offset_x + right + CROP_MARGIN_PX),
+        min(gray.height, offset_y + bottom + CROP_MARGIN_PX),
+    ))
+
+
+# Executed inside the worker processes
+def preprocess_image(data):
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    gray = ImageOps.autocontrast(image.convert("L"), cutoff=1)
+
+    # Downscale first so the remaining steps work on OCR-sized pixels only
+    max_edge = int(PAGE_LONG_EDGE_IN * OCR_DPI)
+    if max(gray.size) > max_edge:
+        gray.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    angle = _estimate_skew(gray)
+    if abs(angle) >= SKEW_STEP_DEGREES:
+        gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+    gray = _crop_to_content(gray)
+    output = io.BytesIO()
+    gray.save(output, format="JPEG", quality=JPEG_QUALITY, optimize=True, dpi=(OCR_DPI, OCR_DPI))
+    return output.getvalue()
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = new_process_pool(IMAGE_WORKERS)
+        return _pool
+
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def images_to_pdf(pages):
+    images = [Image.open(io.BytesIO(page)) for page in pages]
+    output = io.BytesIO()
+    # Pillow stores each grayscale page as a DCT (JPEG) stream at JPEG_QUALITY
+    images[0].save(
+        output,
+        format="PDF",
+        save_all=True,
+        append_images=images[1:],
+        resolution=float(OCR_DPI),
+        quality=JPEG_QUALITY,
+    )
+    return output.getvalue()
+
+
+def prepare_document(files):
+    # files is a list of (name, bytes). Returns (pdf bytes, bytes received, bytes to upload)
+    bytes_in = sum(len(data) for _, data in files)
+    images = [data for name, data in files if is_image(name)]
+    if not images:
+        if len(files) != 1:
+            raise ValueError("Please upload a single PDF or one or more images")
+        return files[0][1], bytes_in, bytes_in
+    if len(images) != len(files):
+        raise ValueError("Please upload either a single PDF or images, not both")
+
+    pages = list(_get_pool().map(preprocess_image, images))
+    document = images_to_pdf(pages)
+    logger.info(
+        f"Preprocessed {len(images)} image(s): {bytes_in / 1024:.0f} KiB -> {len(document) / 1024:.0f} KiB"
+    )
+    return document, bytes_in, len(document)
@@ -0,0 +1,375 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+CREATE_JOBS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        id BIGSERIAL PRIMARY KEY,
+        user_email VARCHAR(100) NOT NULL,
+        customer_id VARCHAR(100),
+        file_sha256 CHAR(64) NOT NULL,
+        file_data BYTEA,
+        status VARCHAR(20) NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        result TEXT,
+        analysis_id VARCHAR(100),
+        error TEXT,
+        worker VARCHAR(200),
+        enqueued_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+        started_at TIMESTAMPTZ,
+        locked_until TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ,
+        metered_at TIMESTAMPTZ
+    );
+    ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS metered_at TIMESTAMPTZ;
+    CREATE INDEX IF NOT EXISTS analysis_jobs_claim_idx
+        ON analysis_jobs (run_after, id) WHERE status IN ('queued', 'running');
+    CREATE INDEX IF NOT EXISTS analysis_jobs_user_idx
+        ON analysis_jobs (user_email, id);
+    CREATE INDEX IF NOT EXISTS analysis_jobs_customer_idx
+        ON analysis_jobs (customer_id, id) WHERE status = 'done';
+"""
+
+# An identical job (same customer and file) that is still pending is reused instead of enqueued twice
+ENQUEUE_SQL = """
+    WITH existing AS (
+        SELECT id FROM analysis_jobs
+        WHERE customer_id = %(customer_id)s AND file_sha256 = %(file_sha256)s
+          AND status IN ('queued', 'running')
+        ORDER BY id
+        LIMIT 1
+    ),
+    inserted AS (
+        INSERT INTO analysis_jobs (user_email, customer_id, file_sha256, file_data)
+        SELECT %(user_email)s, %(customer_id)s, %(file_sha256)s, %(file_data)s
+        WHERE NOT EXISTS (SELECT 1 FROM existing)
+        RETURNING id
+    )
+    SELECT id FROM existing
+    UNION ALL
+    SELECT id FROM inserted
+"""
+
+# Running jobs whose lock expired belong to a worker that died and are claimable
+# again, unless they already used up their attempts (see EXPIRE_SQL)
+CLAIM_SQL = """
+    UPDATE analysis_jobs
+    SET status = 'running',
+        attempts = attempts + 1,
+        worker = %(worker)s,
+        started_at = now(),
+        locked_until = now() + make_interval(secs => %(visibility_timeout)s)
+    WHERE id = (
+        SELECT id FROM analysis_jobs
+        WHERE run_after <= now()
+          AND (status = 'queued' OR (status = 'running' AND locked_until < now()))
+          AND attempts < %(max_attempts)s
+        ORDER BY id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING id, user_email, customer_id, file_sha256, file_data, attempts,
+              EXTRACT(EPOCH FROM started_at - enqueued_at)
+"""
+
+# Keeps a running job's lock alive while its handler is still working on it
+HEARTBEAT_SQL = """
+    UPDATE analysis_jobs SET locked_until = now() + make_interval(secs => %s)
+    WHERE id = %s AND worker = %s AND status = 'running'
+"""
+
+COMPLETE_SQL = """
+    UPDATE analysis_jobs
+    SET status = 'done', result = %s, analysis_id = %s, error = NULL,
+        file_data = NULL, finished_at = now(), locked_until = NULL
+    WHERE id = %s AND worker = %s
+"""
+
+FAIL_SQL = """
+    UPDATE analysis_jobs
+    SET status = 'failed', error = %s, file_data = NULL, finished_at = now(), locked_until = NULL
+    WHERE id = %s AND worker = %s
+"""
+
+# A job whose worker keeps dying (e.g. out of memory) would otherwise be reclaimed forever
+EXPIRE_SQL = """
+    UPDATE analysis_jobs
+    SET status = 'failed', error = 'The analysis worker stopped responding', file_data = NULL,
+        finished_at = now(), locked_until = NULL
+    WHERE status = 'running' AND locked_until < now() AND attempts >= %s
+"""
+
+RETRY_SQL = """
+    UPDATE analysis_jobs
+    SET status = 'queued', error = %s, locked_until = NULL,
+        run_after = now() + make_interval(secs => %s)
+    WHERE id = %s AND worker = %s
+"""
+
+# A rate-limited job is not the job's fault, so it does not use up an attempt
+DEFER_SQL = """
+    UPDATE analysis_jobs
+    SET status = 'queued', attempts = attempts - 1, locked_until = NULL,
+        run_after = now() + make_interval(secs => %s)
+    WHERE id = %s AND worker = %s
+"""
+
+GET_JOB_SQL = """
+    SELECT id, status, result, analysis_id, error
+    FROM analysis_jobs
+    WHERE id = %s AND user_email = %s
+"""
+
+# Only one session gets the row back, so a report is billed once however often it is viewed
+MARK_METERED_SQL = """
+    UPDATE analysis_jobs SET metered_at = now()
+    WHERE id = %s AND status = 'done' AND metered_at IS NULL
+    RETURNING id
+"""
+
+UNMARK_METERED_SQL = "UPDATE analysis_jobs SET metered_at = NULL WHERE id = %s"
+
+# A failed job is not resumed; its error was shown when it failed
+LATEST_JOB_SQL = """
+    SELECT id FROM analysis_jobs
+    WHERE user_email = %s AND enqueued_at > now() - make_interval(secs => %s)
+      AND status IN ('queued', 'running', 'done')
+    ORDER BY id DESC
+    LIMIT 1
+"""
+
+METRICS_SQL = """
+    SELECT
+        count(*) FILTER (WHERE status = 'queued'),
+        count(*) FILTER (WHERE status = 'running'),
+        COALESCE(EXTRACT(EPOCH FROM now() - min(enqueued_at) FILTER (WHERE status = 'queued')), 0),
+        AVG(EXTRACT(EPOCH FROM started_at - enqueued_at)) FILTER (WHERE status = 'done' AND finished_at > now() - interval '1 hour'),
+        AVG(EXTRACT(EPOCH FROM finished_at - started_at)) FILTER (WHERE status = 'done' AND finished_at > now() - interval '1 hour'),
+        count(*) FILTER (WHERE status = 'failed' AND finished_at > now() - interval '1 hour')
+    FROM analysis_jobs
+    WHERE status IN ('queued', 'running') OR finished_at > now() - interval '1 hour'
+"""
+
+
+def log_queue_metrics(metrics):
+    logger.info(
+        "Queue depth {queued}, running {running}, oldest queued {oldest_queued_s:.0f} s, "
+        "avg wait {avg_wait_s:.1f} s, avg run {avg_run_s:.1f} s, failed (1h) {failed_last_hour}".format(**metrics)
+    )
+
+
+class RetryLater(Exception):
+    def __init__(self, delay_s, reason):
+        super().__init__(reason)
+        self.delay_s = delay_s
+
+
+def _fetchone(connection, sql, params):
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        result = cur.fetchone()
+        conn.commit()
+        return result
+
+
+def _execute(connection, sql, params):
+    # Returns the number of rows affected
+    with connection() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        conn.commit()
+        return cur.rowcount
+
+
+def enqueue(connection, user_email, customer_id, file_sha256, file_data):
+    return _fetchone(connection, ENQUEUE_SQL, {
+        "user_email": user_email,
+        "customer_id": customer_id,
+        "file_sha256": file_sha256,
+        "file_data": file_data,
+    })[0]
+
+
+def get_job(connection, job_id, user_email):
+    row = _fetchone(connection, GET_JOB_SQL, (job_id, user_email))
+    if not row:
+        return None
+    return dict(zip(("id", "status", "result", "analysis_id", "error"), row))
+
+
+def claim_metering(connection, job_id):
+    # True if the caller should submit the usage record for this job
+    return _fetchone(connection, MARK_METERED_SQL, (job_id,)) is not None
+
+
+def release_metering(connection, job_id):
+    _execute(connection, UNMARK_METERED_SQL, (job_id,))
+
+
+def latest_job_id(connection, user_email, window_s):
+    row = _fetchone(connection, LATEST_JOB_SQL, (user_email, window_s))
+    return row[0] if row else None
+
+
+def queue_metrics(connection):
+    row = _fetchone(connection, METRICS_SQL, None)
+    return {
+        "queued": row[0],
+        "running": row[1],
+        "oldest_queued_s": float(row[2] or 0),
+        "avg_wait_s": float(row[3] or 0),
+        "avg_run_s": float(row[4] or 0),
+        "failed_last_hour": row[5],
+    }
+
+
+class JobWorkerPool:
+    # Worker threads that claim jobs with FOR UPDATE SKIP LOCKED, so any number
+    # of these pools, in the app or in worker.py processes, can share one queue.
+
+    def __init__(self, connection, handler, threads=2, poll_interval_s=1.0,
+                 visibility_timeout_s=900, max_attempts=3, retry_delay_s=30, heartbeat_interval_s=None,
+                 metrics_interval_s=None):
+        self.connection = connection
+        self.handler = handler
+        self.threads = threads
+        self.poll_interval_s = poll_interval_s
+        self.visibility_timeout_s = visibility_timeout_s
+        self.max_attempts = max_attempts
+        self.retry_delay_s = retry_delay_s
+        # The lock is renewed well before it runs out, so only a dead worker loses its jobs
+        self.heartbeat_interval_s = heartbeat_interval_s or visibility_timeout_s / 3
+        # Queue depth, wait and run times are read and logged every metrics_interval_s
+        self.metrics_interval_s = metrics_interval_s
+        self.metrics = None
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.threads):
+            thread = threading.Thread(
+                target=self._run, args=(f"{self.name}:{index}",), name=f"analysis-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        if self.metrics_interval_s:
+            thread = threading.Thread(target=self._report_metrics, name="analysis-queue-metrics", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.threads} analysis worker thread(s) as {self.name}")
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _report_metrics(self):
+        while not self._stop.wait(self.metrics_interval_s):
+            try:
+                self.metrics = queue_metrics(self.connection)
+            except Exception as e:
+                logger.error(f"Error reading queue metrics: {e}")
+                continue
+            log_queue_metrics(self.metrics)
+
+    def _claim(self, worker):
+        return _fetchone(self.connection, CLAIM_SQL, {
+            "worker": worker,
+            "visibility_timeout": self.visibility_timeout_s,
+            "max_attempts": self.max_attempts,
+        })
+
+    def _expire(self):
+        with self.connection() as conn, conn.cursor() as cur:
+            cur.execute(EXPIRE_SQL, (self.max_attempts,))
+            expired = cur.rowcount
+            conn.commit()
+        if expired:
+            logger.error(f"Failed {expired} analysis job(s) whose worker died on every attempt")
+
+    def _run(self, worker):
+        while not self._stop.is_set():
+            try:
+                job = self._claim(worker)
+            except Exception as e:
+                logger.error(f"Error claiming analysis job: {e}")
+                self._stop.wait(self.poll_interval_s * 5)
+                continue
+            if not job:
+                try:
+                    self._expire()
+                except Exception as e:
+                    logger.error(f"Error expiring abandoned analysis jobs: {e}")
+                self._stop.wait(self.poll_interval_s)
+                continue
+            try:
+                self._process(worker, job)
+            except Exception as e:
+                # The lock expires and another worker picks the job up again
+                logger.error(f"Error recording result of analysis job {job[0]}: {e}")
+
+    def _heartbeat(self, worker, job_id, done):
+        while not done.wait(self.heartbeat_interval_s):
+            try:
+                if not _execute(self.connection, HEARTBEAT_SQL, (self.visibility_timeout_s, job_id, worker)):
+                    logger.error(f"Analysis job {job_id} is no longer held by {worker}; another worker may rerun it")
+                    return
+            except Exception as e:
+                # Try again next interval; the lock only runs out after visibility_timeout_s
+                logger.error(f"Error extending the lock of analysis job {job_id}: {e}")
+
+    def _record(self, worker, job_id, outcome, sql, params):
+        # The UPDATEs only match while this worker still holds the job
+        if not _execute(self.connection, sql, params):
+            logger.error(
+                f"Could not record {outcome} of analysis job {job_id}: it was reclaimed by another worker"
+            )
+            return False
+        return True
+
+    def _handle(self, worker, job_id, *args):
+        # Runs the handler while a heartbeat keeps the job's lock alive
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(worker, job_id, done), name=f"analysis-heartbeat-{job_id}", daemon=True
+        )
+        heartbeat.start()
+        try:
+            return self.handler(*args)
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def _process(self, worker, job):
+        job_id, user_email, customer_id, file_sha256, file_data, attempts, wait_s = job
+        started = time.perf_counter()
+        try:
+            result, analysis_id = self._handle(worker, job_id, customer_id, file_sha256, bytes(file_data))
+        except RetryLater as e:
+            logger.warning(f"Deferring analysis job {job_id} by {e.delay_s} s: {e}")
+            self._record(worker, job_id, "the deferral", DEFER_SQL, (e.delay_s, job_id, worker))
+            return
+        except Exception as e:
+            run_s = time.perf_counter() - started
+            if attempts < self.max_attempts:
+                logger.error(f"Analysis job {job_id} attempt {attempts} failed after {run_s:.1f} s, retrying: {e}")
+                self._record(worker, job_id, "the retry", RETRY_SQL,
+                             (str(e), self.retry_delay_s * attempts, job_id, worker))
+            else:
+                logger.error(f"Analysis job {job_id} failed after {attempts} attempts: {e}")
+                self._record(worker, job_id, "the failure", FAIL_SQL, (str(e), job_id, worker))
+            return
+
+        if not self._record(worker, job_id, "the result", COMPLETE_SQL, (result, analysis_id, job_id, worker)):
+            return
+        logger.info(
+            f"Analysis job {job_id} done: waited {float(wait_s or 0):.1f} s in queue, "
+            f"ran {time.perf_counter() - started:.1f} s"
+        )
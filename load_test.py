@@ -0,0 +1,431 @@
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+# Drives many simulated users through the real app.py with Streamlit's headless
+# AppTest: login, upload, ANALYZE, a few chat turns, the profile menu and logout.
+# AWS is replaced by in-process fakes, the Lambda backend by a local HTTP server
+# and RDS by the PostgreSQL at --dsn, so the numbers describe this node alone.
+#   python load_test.py --dsn "dbname=loadtest user=postgres host=localhost" --users 20 --duration 120
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+LOAD_TEST_PASSWORD = "Load-Test-Passw0rd!"
+CHAT_QUESTIONS = [
+    "Which of my results are outside the normal range?",
+    "What does a high LDL cholesterol mean?",
+    "Should I be worried about my vitamin D level?",
+    "What could cause a low hemoglobin?",
+    "Which values should I discuss with my doctor first?",
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class FakeAwsClient:
+    # Just enough of Secrets Manager, SES and the Marketplace APIs for app.py
+
+    def __init__(self, secrets):
+        self.secrets = secrets
+
+    def get_secret_value(self, SecretId):
+        return {"SecretString": json.dumps(self.secrets)}
+
+    def describe_secret(self, SecretId):
+        return {"Name": SecretId}
+
+    def send_raw_email(self, **kwargs):
+        return {"MessageId": uuid.uuid4().hex}
+
+    def get_send_quota(self):
+        return {"Max24HourSend": 50000.0, "MaxSendRate": 14.0, "SentLast24Hours": 0.0}
+
+    def get_entitlements(self, **kwargs):
+        return {"Entitlements": [], "ResponseMetadata": {"HTTPHeaders": {"date": formatdate(usegmt=True)}}}
+
+    def batch_meter_usage(self, **kwargs):
+        return {"Results": [], "UnprocessedRecords": []}
+
+
+def patch_aws(secrets):
+    client = FakeAwsClient(secrets)
+
+    class FakeSession:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def client(self, *args, **kwargs):
+            return client
+
+    patches = [
+        mock.patch("boto3.session.Session", FakeSession),
+        mock.patch("boto3.Session", FakeSession),
+        mock.patch("boto3.client", lambda *args, **kwargs: client),
+    ]
+    for patch in patches:
+        patch.start()
+    return patches
+
+
+def patch_streamlit_runtime():
+    # AppTest installs a stub runtime for each run and clears it afterwards.
+    # With overlapping sessions one run can clear it while another is still
+    # executing, so fall back to a shared stub instead of raising.
+    # Each AppTest also compiles app.py into its own script cache; on Python
+    # 3.11 concurrent compiles can fail with "AST constructor recursion depth
+    # mismatch", so share one cache, as the sessions of a real server do.
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    shared = mock.MagicMock(spec=Runtime)
+    script_cache = ScriptCache()
+    patches = [
+        mock.patch.object(Runtime, "instance", classmethod(lambda cls: cls._instance or shared)),
+        mock.patch.object(Runtime, "exists", classmethod(lambda cls: True)),
+        mock.patch("streamlit.testing.v1.app_test.ScriptCache", lambda: script_cache),
+        mock.patch("streamlit.testing.v1.local_script_runner.ScriptCache", lambda: script_cache),
+    ]
+    for patch in patches:
+        patch.start()
+    return patches
+
+
+class FakeBackend:
+    # Local stand-in for the analysis Lambda with configurable latency
+
+    def __init__(self, analysis_latency_s, chat_latency_s):
+        self.analysis_latency_s = analysis_latency_s
+        self.chat_latency_s = chat_latency_s
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def _handler(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._reply({"status": "ok"})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with backend._lock:
+                    backend.requests += 1
+                if self.path.rstrip("/").endswith("analyze-text-from-pdf"):
+                    time.sleep(random.uniform(0.5, 1.5) * backend.analysis_latency_s)
+                    self._reply({"result": "Report summary: all values within range.", "analysis_id": uuid.uuid4().hex})
+                elif self.path.rstrip("/").endswith("chat"):
+                    time.sleep(random.uniform(0.5, 1.5) * backend.chat_latency_s)
+                    self._reply({"response": "This is a simulated answer about your lab report."})
+                else:
+                    self.send_error(404)
+
+            def _reply(self, body):
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-backend", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def make_pdf(label):
+    # A one-page PDF; the label makes each session's upload distinct so the
+    # analysis is not served from the shared cache
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    writer.add_blank_page(width=612, height=792)
+    writer.add_metadata({"/Title": label})
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def seed_users(connect, users):
+    from password_hashing import hash_password
+
+    # One hash for everyone: logins still pay the full verification cost
+    stored = hash_password(LOAD_TEST_PASSWORD)
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            for index in range(users):
+                cur.execute("""
+                    WITH customer AS (
+                        INSERT INTO product_customers (product_code, customer_id, customer_aws_account_id)
+                        VALUES ('loadtest', %(customer_id)s, '000000000000')
+                        ON CONFLICT (customer_id) DO UPDATE SET product_code = EXCLUDED.product_code
+                        RETURNING id
+                    )
+                    INSERT INTO users (username, email, password, customer_id)
+                    SELECT %(username)s, %(email)s, %(password)s, id FROM customer
+                    ON CONFLICT DO NOTHING
+                """, {
+                    "customer_id": f"loadtest-{index}",
+                    "username": f"Load Test {index}",
+                    "email": f"loadtest-{index}@example.com",
+                    "password": stored,
+                })
+        conn.commit()
+    finally:
+        conn.close()
+    return [f"loadtest-{index}@example.com" for index in range(users)]
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.analysis_s = []
+        self.errors = {}
+        self.sessions = 0
+        self.failed_sessions = 0
+
+    def step(self, name, action):
+        started = time.perf_counter()
+        at = action()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies.setdefault(name, []).append(elapsed)
+        if at.exception:
+            raise RuntimeError(f"{name}: {at.exception[0].value}")
+        return at
+
+    def error(self, message):
+        with self._lock:
+            self.errors[message] = self.errors.get(message, 0) + 1
+            self.failed_sessions += 1
+
+    def session_done(self):
+        with self._lock:
+            self.sessions += 1
+
+    def analysis_done(self, elapsed):
+        with self._lock:
+            self.analysis_s.append(elapsed)
+
+
+class Sampler:
+    # Peak RSS, threads and database connections of this node while the test runs
+
+    def __init__(self, connect, interval_s=0.5):
+        self.connect = connect
+        self.interval_s = interval_s
+        self.peak_threads = 0
+        self.peak_db_connections = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @staticmethod
+    def peak_rss_mb():
+        # ru_maxrss is in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    def _run(self):
+        conn = self.connect()
+        conn.autocommit = True
+        try:
+            while not self._stop.is_set():
+                self.peak_threads = max(self.peak_threads, threading.active_count())
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT count(*) FROM pg_stat_activity
+                        WHERE datname = current_database() AND pid <> pg_backend_pid()
+                    """)
+                    self.peak_db_connections = max(self.peak_db_connections, cur.fetchone()[0])
+                self._stop.wait(self.interval_s)
+        finally:
+            conn.close()
+
+
+def think(mean_s):
+    if mean_s > 0:
+        time.sleep(random.uniform(0.5, 1.5) * mean_s)
+
+
+def find_button(at, label):
+    return next(button for button in at.button if button.label.strip() == label)
+
+
+def run_session(email, recorder, args):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=args.run_timeout)
+    recorder.step("load", at.run)
+
+    at.text_input(key="login_email").input(email)
+    at.text_input(key="login_password").input(LOAD_TEST_PASSWORD)
+    recorder.step("login", find_button(at, "Login").click().run)
+    if not at.session_state["login_success"]:
+        raise RuntimeError("login failed")
+    think(args.think_time)
+
+    pdf = make_pdf(f"{email} {uuid.uuid4().hex}")
+    recorder.step("upload", at.file_uploader[0].set_value([("report.pdf", pdf, "application/pdf")]).run)
+    started = time.perf_counter()
+    recorder.step("analyze", find_button(at, "ANALYZE").click().run)
+    # run_every fragments do not tick under AppTest, so poll like the browser would
+    while not at.session_state["content_generated"]:
+        if time.perf_counter() - started > args.analysis_timeout:
+            raise RuntimeError("analysis timed out")
+        time.sleep(args.poll_interval)
+        recorder.step("poll", at.run)
+    recorder.analysis_done(time.perf_counter() - started)
+    think(args.think_time)
+
+    for question in random.sample(CHAT_QUESTIONS, min(args.chat_turns, len(CHAT_QUESTIONS))):
+        recorder.step("chat", at.chat_input(key="chat_input").set_value(question).run)
+        think(args.think_time)
+
+    recorder.step("profile_menu", at.button(key="profile_button").click().run)
+    think(args.think_time)
+    recorder.step("close_menu", find_button(at, "Close Menu").click().run)
+    recorder.step("profile_menu", at.button(key="profile_button").click().run)
+    recorder.step("logout", find_button(at, "Logout").click().run)
+
+
+def virtual_user(email, recorder, args, deadline):
+    while time.monotonic() < deadline:
+        try:
+            run_session(email, recorder, args)
+            recorder.session_done()
+        except Exception as e:
+            recorder.error(str(e)[:200])
+        think(args.think_time)
+
+
+def report(recorder, sampler, backend, elapsed):
+    all_latencies = [value for values in recorder.latencies.values() for value in values]
+    print(f"{'sessions':>20}: {recorder.sessions} ok, {recorder.failed_sessions} failed in {elapsed:.1f} s")
+    print(f"{'sessions/s':>20}: {recorder.sessions / elapsed:.2f}")
+    if all_latencies:
+        print(
+            f"{'interactions':>20}: {len(all_latencies)}, p50 {statistics.median(all_latencies) * 1000:.0f} ms, "
+            f"p95 {percentile(all_latencies, 95) * 1000:.0f} ms, p99 {percentile(all_latencies, 99) * 1000:.0f} ms"
+        )
+    for name, values in recorder.latencies.items():
+        print(
+            f"{name:>20}: {len(values)}, p50 {statistics.median(values) * 1000:.0f} ms, "
+            f"p95 {percentile(values, 95) * 1000:.0f} ms, p99 {percentile(values, 99) * 1000:.0f} ms"
+        )
+    if recorder.analysis_s:
+        print(
+            f"{'upload to report':>20}: p50 {statistics.median(recorder.analysis_s):.1f} s, "
+            f"p95 {percentile(recorder.analysis_s, 95):.1f} s"
+        )
+    print(f"{'peak RSS':>20}: {sampler.peak_rss_mb():.0f} MiB")
+    print(f"{'peak threads':>20}: {sampler.peak_threads}")
+    print(f"{'peak DB connections':>20}: {sampler.peak_db_connections}")
+    print(f"{'backend requests':>20}: {backend.requests}")
+    for message, count in sorted(recorder.errors.items(), key=lambda item: -item[1]):
+        print(f"{'error':>20}: {count} x {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent session load test for app.py")
+    parser.add_argument("--dsn", required=True, help="libpq connection string of a disposable PostgreSQL database")
+    parser.add_argument("--users", type=int, default=10, help="Concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to keep starting sessions")
+    parser.add_argument("--ramp-up", type=float, default=10, help="Seconds over which users start")
+    parser.add_argument("--think-time", type=float, default=2, help="Mean pause between interactions")
+    parser.add_argument("--chat-turns", type=int, default=3)
+    parser.add_argument("--analysis-latency", type=float, default=3, help="Mean fake backend analysis time")
+    parser.add_argument("--chat-latency", type=float, default=1, help="Mean fake backend chat time")
+    parser.add_argument("--poll-interval", type=float, default=1)
+    parser.add_argument("--analysis-timeout", type=float, default=120)
+    parser.add_argument("--run-timeout", type=float, default=30, help="Timeout of a single script run")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    import psycopg2
+    from psycopg2.extensions import parse_dsn
+
+    params = parse_dsn(args.dsn)
+
+    def connect():
+        return psycopg2.connect(args.dsn)
+
+    backend = FakeBackend(args.analysis_latency, args.chat_latency).start()
+    # app.py reads these at import; its own health server would clash between runs
+    os.environ["BACKEND_URL"] = backend.url
+    os.environ.setdefault("HEALTH_PORT", "0")
+    patches = patch_aws({
+        "username": params.get("user", ""),
+        "password": params.get("password", ""),
+        "RDS_DB_HOST": params.get("host", "localhost"),
+        "RDS_DB_NAME": params.get("dbname", ""),
+        "RDS_DB_PORT": params.get("port", "5432"),
+        "SENDER_EMAIL": "loadtest@example.com",
+        "region_name": "us-east-1",
+        "bucket_name": "loadtest",
+    })
+    patches += patch_streamlit_runtime()
+
+    try:
+        # One run creates the schema and starts the app's shared resources
+        from streamlit.testing.v1 import AppTest
+        AppTest.from_file(APP_PATH, default_timeout=args.run_timeout).run()
+        emails = seed_users(connect, args.users)
+
+        recorder = Recorder()
+        sampler = Sampler(connect).start()
+        started = time.monotonic()
+        deadline = started + args.duration
+        threads = []
+        for index, email in enumerate(emails):
+            thread = threading.Thread(
+                target=virtual_user, args=(email, recorder, args, deadline), name=f"user-{index}", daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+            time.sleep(args.ramp_up / max(1, len(emails)))
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        sampler.stop()
+        report(recorder, sampler, backend, elapsed)
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+        backend.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from process_pool import new_process_pool
+
+logger = logging.getLogger(__name__)
+
+# scrypt cost settings. N is calibrated at startup so that one hash takes
+# roughly PASSWORD_HASH_TARGET_MS on this host; r and p stay fixed.
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MIN_N = 2 ** 14
+SCRYPT_MAX_N = 2 ** 20
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+PASSWORD_HASH_TARGET_MS = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+# Stored for accounts created without a password (bulk imports); matches nothing,
+# so the user has to set one through "Forgot Password" first
+UNUSABLE_PASSWORD = "!"
+
+_lock = threading.Lock()
+_calibration_lock = threading.Lock()
+_pool = None
+_scrypt_n = None
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode(),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * r * n,
+        dklen=KEY_BYTES,
+    )
+
+
+def _encode(n, r, p, salt, key):
+    return "scrypt${}${}${}${}${}".format(
+        n, r, p,
+        base64.b64encode(salt).decode(),
+        base64.b64encode(key).decode(),
+    )
+
+
+def _decode(stored):
+    _, n, r, p, salt, key = stored.split("$")
+    return int(n), int(r), int(p), base64.b64decode(salt), base64.b64decode(key)
+
+
+# Executed inside the worker processes
+def _hash_in_worker(password, n, r, p):
+    salt = secrets.token_bytes(SALT_BYTES)
+    return _encode(n, r, p, salt, _scrypt(password, salt, n, r, p))
+
+
+def _verify_in_worker(password, stored):
+    n, r, p, salt, key = _decode(stored)
+    return hmac.compare_digest(_scrypt(password, salt, n, r, p), key)
+
+
+def is_legacy_hash(stored):
+    return bool(stored) and _LEGACY_SHA256.match(stored) is not None
+
+
+def calibrate(target_ms=PASSWORD_HASH_TARGET_MS):
+    # Double N until a single hash reaches the target latency
+    salt = secrets.token_bytes(SALT_BYTES)
+    n = SCRYPT_MIN_N
+    while n < SCRYPT_MAX_N:
+        start = time.perf_counter()
+        _scrypt("calibration", salt, n, SCRYPT_R, SCRYPT_P)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms >= target_ms:
+            break
+        n *= 2
+    logger.info(f"Calibrated scrypt cost N={n} for a {target_ms:.0f} ms target")
+    return n
+
+
+def get_scrypt_n():
+    global _scrypt_n
+    # Calibration runs in the pool so its scrypt runs stay out of the server process
+    with _calibration_lock:
+        if _scrypt_n is None:
+            _scrypt_n = _run(calibrate)
+        return _scrypt_n
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn rather than fork: the Streamlit server is multi-threaded
+            _pool = new_process_pool(PASSWORD_HASH_WORKERS)
+        return _pool
+
+
+def _run(fn, *args):
+    global _pool
+    try:
+        return _get_pool().submit(fn, *args).result()
+    except BrokenProcessPool:
+        logger.error("Password hashing pool died, restarting it")
+        with _lock:
+            _pool = None
+        return _get_pool().submit(fn, *args).result()
+
+
+def shutdown():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def hash_password(password):
+    return _run(_hash_in_worker, password, get_scrypt_n(), SCRYPT_R, SCRYPT_P)
+
+
+def verify_password(password, stored):
+    # Returns (matches, needs_rehash)
+    if not stored or stored == UNUSABLE_PASSWORD:
+        return False, False
+    if is_legacy_hash(stored):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        matches = hmac.compare_digest(legacy, stored)
+        return matches, matches
+    if not stored.startswith("scrypt$"):
+        logger.error("Unrecognised password hash format")
+        return False, False
+    matches = _run(_verify_in_worker, password, stored)
+    n, r, p, _, _ = _decode(stored)
+    needs_rehash = matches and (n < get_scrypt_n() or r != SCRYPT_R or p != SCRYPT_P)
+    return matches, needs_rehash
@@ -0,0 +1,83 @@
+import hashlib
+import io
+import logging
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ContentStream, NameObject
+
+logger = logging.getLogger(__name__)
+
+# Operators that put marks on the page: path painting, shading, text showing,
+# XObjects and inline images (which pypdf reports as one "INLINE IMAGE" operation)
+PAINTING_OPERATORS = {
+    b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*", b"sh",
+    b"Tj", b"TJ", b"'", b'"',
+    b"Do", b"INLINE IMAGE",
+}
+
+
+def page_count(data):
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def _xobject_streams(page):
+    resources = page.get("/Resources")
+    if resources is None:
+        return []
+    xobjects = resources.get_object().get(NameObject("/XObject"))
+    if xobjects is None:
+        return []
+    return [xobject.get_object() for xobject in xobjects.get_object().values()]
+
+
+def _paints(page, contents):
+    # Text extraction misses vector drawings, outlined or Type3 text and inline
+    # images, so blankness is decided from the content stream operators
+    if contents is None:
+        return False
+    operations = ContentStream(contents, page.pdf).operations
+    return any(operator in PAINTING_OPERATORS for _, operator in operations)
+
+
+def _page_fingerprint(page):
+    digest = hashlib.sha256()
+    contents = page.get_contents()
+    content_bytes = contents.get_data() if contents is not None else b""
+    digest.update(content_bytes)
+    # Scanned pages share the same content stream, so the images must be part of the fingerprint
+    images = _xobject_streams(page)
+    for image in images:
+        digest.update(image.get_data())
+    blank = not images and not _paints(page, contents)
+    return digest.hexdigest(), blank
+
+
+def split_pdf(data, shard_pages):
+    # Returns [(first_page, last_page, pdf bytes)] with 1-based page numbers of the original,
+    # skipping blank pages and exact duplicates of an earlier page.
+    reader = PdfReader(io.BytesIO(data))
+    kept = []
+    seen = set()
+    for number, page in enumerate(reader.pages, start=1):
+        try:
+            fingerprint, blank = _page_fingerprint(page)
+        except Exception as e:
+            logger.warning(f"Could not fingerprint page {number}, keeping it: {e}")
+            kept.append((number, page))
+            continue
+        if blank or fingerprint in seen:
+            logger.info(f"Skipping {'blank' if blank else 'duplicate'} page {number}")
+            continue
+        seen.add(fingerprint)
+        kept.append((number, page))
+
+    shards = []
+    for start in range(0, len(kept), shard_pages):
+        chunk = kept[start:start + shard_pages]
+        writer = PdfWriter()
+        for _, page in chunk:
+            writer.add_page(page)
+        output = io.BytesIO()
+        writer.write(output)
+        shards.append((chunk[0][0], chunk[-1][0], output.getvalue()))
+    return shards
@@ -0,0 +1,61 @@
+import multiprocessing
+import multiprocessing.spawn
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Spawned workers normally re-run the parent's __main__ before doing any work.
+# Under Streamlit that is app.py, so every worker would fetch secrets, check
+# the schema and open a database pool. Workers started here skip that step and
+# only import the modules their tasks are pickled from.
+#
+# This swaps out multiprocessing.spawn.get_preparation_data, which is not a
+# public API; if its data keys change, workers fall back to re-running __main__.
+
+WARMUP_TIMEOUT_S = 60
+
+_spawn_lock = threading.Lock()
+_warmup_barrier = None
+
+
+def _init_worker(barrier):
+    global _warmup_barrier
+    _warmup_barrier = barrier
+
+
+def _warmup():
+    # Holds the worker until every warm-up task has been submitted, so no
+    # worker goes idle and gets reused while the pool is still starting
+    _warmup_barrier.wait(WARMUP_TIMEOUT_S)
+
+
+def new_process_pool(max_workers):
+    context = multiprocessing.get_context("spawn")
+    original = multiprocessing.spawn.get_preparation_data
+
+    def without_main(name):
+        data = original(name)
+        data.pop("init_main_from_path", None)
+        data.pop("init_main_from_name", None)
+        return data
+
+    # Every worker plus this thread
+    barrier = context.Barrier(max_workers + 1)
+    with _spawn_lock:
+        multiprocessing.spawn.get_preparation_data = without_main
+        try:
+            pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(barrier,),
+            )
+            # With spawn, a submit that finds no idle worker starts a new one.
+            # The warm-up tasks block until all are submitted, so this starts
+            # every worker now and the pool never spawns again afterwards.
+            warmup = [pool.submit(_warmup) for _ in range(max_workers)]
+        finally:
+            multiprocessing.spawn.get_preparation_data = original
+    barrier.wait(WARMUP_TIMEOUT_S)
+    for future in warmup:
+        future.result()
+    return pool
@@ -0,0 +1,22 @@
+import os
+import sys
+
+# Starts /livez and /readyz before Streamlit, so a freshly started replica
+# answers the load balancer before any browser session has rendered the page:
+#   python serve.py --server.port 8501      (arguments go to "streamlit run")
+
+
+def main():
+    # Loads the secrets, database settings and clients the probes use from the app
+    import app
+
+    app.start_health_server()
+
+    from streamlit.web import cli
+
+    sys.argv = ["streamlit", "run", os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), *sys.argv[1:]]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()
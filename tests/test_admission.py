@@ -0,0 +1,126 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from admission import AdmissionController, AdmissionRejected, Limits, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def controller(limits=Limits(6000, 100, 5), max_in_flight_total=1, max_wait_s=5.0):
+    return AdmissionController(lambda customer_id, dimension: None, limits,
+                               max_in_flight_total=max_in_flight_total, max_wait_s=max_wait_s)
+
+
+def wait_for(condition, timeout_s=5.0):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.005)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_refills_at_the_configured_rate(self):
+        clock = FakeClock()
+        with mock.patch("admission.time.monotonic", clock):
+            bucket = TokenBucket(requests_per_minute=60, burst=2)
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(bucket.take(), 0)
+            self.assertAlmostEqual(bucket.take(), 1.0)
+
+            clock.now += 0.5
+            self.assertAlmostEqual(bucket.take(), 0.5)
+            clock.now += 0.5
+            self.assertEqual(bucket.take(), 0)
+
+    def test_refill_is_capped_at_burst(self):
+        clock = FakeClock()
+        with mock.patch("admission.time.monotonic", clock):
+            bucket = TokenBucket(requests_per_minute=60, burst=2)
+            clock.now += 3600
+            self.assertEqual(bucket.take(), 0)
+            self.assertEqual(bucket.take(), 0)
+            self.assertGreater(bucket.take(), 0)
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_rejects_when_the_rate_limit_is_reached(self):
+        clock = FakeClock()
+        with mock.patch("admission.time.monotonic", clock):
+            admission = controller(Limits(requests_per_minute=6, burst=1, max_in_flight=5))
+            with admission.admit("a", "ReportGeneration"):
+                pass
+            with self.assertRaises(AdmissionRejected) as rejected:
+                with admission.admit("a", "ReportGeneration"):
+                    pass
+            self.assertEqual(rejected.exception.retry_after, 10)
+
+            clock.now += 10
+            with admission.admit("a", "ReportGeneration"):
+                pass
+
+    def test_grants_slots_round_robin_across_customers(self):
+        admission = controller(max_in_flight_total=1)
+        granted = []
+
+        def request(customer_id, name):
+            with admission.admit(customer_id, "ReportGeneration"):
+                granted.append(name)
+
+        threads = []
+        with admission.admit("a", "ReportGeneration"):
+            # Queue a1 and a2 before b1; once the slot frees up they are served a, b, a
+            for customer_id, name in (("a", "a1"), ("a", "a2"), ("b", "b1")):
+                thread = threading.Thread(target=request, args=(customer_id, name))
+                thread.start()
+                threads.append(thread)
+                wait_for(lambda: admission.stats()["queued"] == len(threads))
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(granted, ["a1", "b1", "a2"])
+        self.assertEqual(admission.stats()["in_flight"], 0)
+
+    def test_caps_in_flight_requests_per_customer(self):
+        admission = controller(Limits(6000, 100, max_in_flight=1), max_in_flight_total=4, max_wait_s=0.05)
+        with admission.admit("a", "ReportGeneration"):
+            with self.assertRaises(AdmissionRejected):
+                with admission.admit("a", "ReportGeneration"):
+                    pass
+            with admission.admit("b", "ReportGeneration"):
+                self.assertEqual(admission.stats()["in_flight"], 2)
+
+    def test_gives_up_after_max_wait(self):
+        admission = controller(max_in_flight_total=1, max_wait_s=0.05)
+        with admission.admit("a", "ReportGeneration"):
+            started = time.monotonic()
+            with self.assertRaises(AdmissionRejected) as rejected:
+                with admission.admit("b", "ReportGeneration"):
+                    pass
+            self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual(rejected.exception.reason, "Too many requests in progress")
+        self.assertEqual(admission.stats(), {"in_flight": 0, "queued": 0, "avg_duration_s": mock.ANY})
+
+    def test_multiple_slots_count_against_both_caps(self):
+        admission = controller(Limits(6000, 100, max_in_flight=2), max_in_flight_total=3, max_wait_s=0.05)
+        with admission.admit("a", "ReportGeneration", slots=8) as slots:
+            self.assertEqual(slots, 2)
+            self.assertEqual(admission.stats()["in_flight"], 2)
+            with self.assertRaises(AdmissionRejected):
+                with admission.admit("b", "ReportGeneration", slots=2):
+                    pass
+            with admission.admit("b", "ReportGeneration") as slots:
+                self.assertEqual(slots, 1)
+        self.assertEqual(admission.stats()["in_flight"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
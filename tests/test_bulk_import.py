@@ -0,0 +1,45 @@
+import csv
+import io
+import unittest
+
+from bulk_import import validate_rows
+
+HEADER = "product_code,customer_id,customer_aws_account_id,username,email\n"
+
+
+def validate(text):
+    return validate_rows(csv.DictReader(io.StringIO(HEADER + text)), lambda email: "@" in email)
+
+
+class ValidateRowsTest(unittest.TestCase):
+    def test_line_numbers_follow_multiline_fields(self):
+        valid, rejected = validate(
+            'p,c1,1,"Ada\nLovelace",ada@example.com\n'
+            "p,c2,1,Bob,not-an-email\n"
+        )
+        self.assertEqual([row["line_number"] for row in valid], [3])
+        self.assertEqual(rejected, [(4, "not-an-email", "invalid email")])
+
+    def test_duplicate_emails_are_matched_case_insensitively(self):
+        valid, rejected = validate(
+            "p,c1,1,Ada,ada@example.com\n"
+            "p,c2,1,Ada,ADA@Example.com\n"
+        )
+        self.assertEqual(len(valid), 1)
+        self.assertEqual(rejected, [(3, "ADA@Example.com", "duplicate email in file")])
+
+    def test_customer_only_rows_and_partial_users(self):
+        valid, rejected = validate(
+            "p,c1,1,,\n"
+            "p,c2,1,Bob,\n"
+            ",c3,1,,\n"
+        )
+        self.assertEqual([row["customer_id"] for row in valid], ["c1"])
+        self.assertEqual(rejected, [
+            (3, "", "username and email must both be set or both be empty"),
+            (4, "", "missing customer fields"),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
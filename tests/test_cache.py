@@ -0,0 +1,140 @@
+import json
+import unittest
+from unittest import mock
+
+from cache import LocalBackend, TwoTierCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FailingBackend:
+    def get(self, key):
+        raise RuntimeError("database down")
+
+    def set(self, key, value, ttl_s):
+        raise RuntimeError("database down")
+
+    def invalidate(self, keys):
+        raise RuntimeError("database down")
+
+    def listen(self, on_invalidate, on_reset):
+        pass
+
+
+class Loader:
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.values.pop(0)
+
+
+class LocalBackendTest(unittest.TestCase):
+    def test_values_expire_after_ttl(self):
+        clock = FakeClock()
+        with mock.patch("cache.time.monotonic", clock):
+            backend = LocalBackend()
+            backend.set("key", "value", 10)
+            self.assertEqual(backend.get("key"), ("value", 10))
+            clock.now += 10
+            self.assertIsNone(backend.get("key"))
+
+    def test_invalidation_reaches_subscribers(self):
+        backend = LocalBackend()
+        received = []
+        backend.listen(received.append, lambda: None)
+        backend.set("a", "1", 60)
+        backend.invalidate(["a", "b"])
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(received, [["a", "b"]])
+
+
+class TwoTierCacheTest(unittest.TestCase):
+    def test_second_get_is_served_from_the_front_tier(self):
+        cache = TwoTierCache(LocalBackend()).start()
+        loader = Loader({"name": "Ada"})
+        self.assertEqual(cache.get("user", loader, 60), {"name": "Ada"})
+        self.assertEqual(cache.get("user", loader, 60), {"name": "Ada"})
+        self.assertEqual(loader.calls, 1)
+        self.assertEqual(cache.stats(), {"front": 1, "back": 0, "miss": 1, "front_size": 1})
+
+    def test_other_replica_reads_the_back_tier(self):
+        back = LocalBackend()
+        TwoTierCache(back).start().get("user", Loader("Ada"), 60)
+        replica = TwoTierCache(back).start()
+        loader = Loader("stale")
+        self.assertEqual(replica.get("user", loader, 60), "Ada")
+        self.assertEqual(loader.calls, 0)
+        self.assertEqual(replica.stats()["back"], 1)
+
+    def test_front_tier_expires_after_ttl(self):
+        clock = FakeClock()
+        with mock.patch("cache.time.monotonic", clock):
+            cache = TwoTierCache(None, front_ttl_s=5)
+            loader = Loader(1, 2)
+            self.assertEqual(cache.get("key", loader, 60), 1)
+            clock.now += 4
+            self.assertEqual(cache.get("key", loader, 60), 1)
+            clock.now += 1
+            self.assertEqual(cache.get("key", loader, 60), 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TwoTierCache(None, front_size=2)
+        cache.get("a", Loader(1), 60)
+        cache.get("b", Loader(2), 60)
+        cache.get("a", Loader(), 60)
+        cache.get("c", Loader(3), 60)
+        self.assertEqual(cache.get("a", Loader(), 60), 1)
+        self.assertEqual(cache.get("c", Loader(), 60), 3)
+        loader = Loader(20)
+        self.assertEqual(cache.get("b", loader, 60), 20)
+        self.assertEqual(loader.calls, 1)
+
+    def test_none_is_not_cached(self):
+        back = LocalBackend()
+        cache = TwoTierCache(back).start()
+        loader = Loader(None, "found")
+        self.assertIsNone(cache.get("key", loader, 60))
+        self.assertIsNone(back.get("key"))
+        self.assertEqual(cache.get("key", loader, 60), "found")
+        self.assertEqual(loader.calls, 2)
+
+    def test_invalidation_drops_every_replicas_front_copy(self):
+        back = LocalBackend()
+        first = TwoTierCache(back).start()
+        second = TwoTierCache(back).start()
+        first.get("user", Loader("old"), 60)
+        second.get("user", Loader(), 60)
+
+        first.invalidate("user")
+        self.assertEqual(second.get("user", Loader("new"), 60), "new")
+        self.assertEqual(first.get("user", Loader(), 60), "new")
+        self.assertEqual(json.loads(back.get("user")[0]), "new")
+
+    def test_back_tier_errors_are_treated_as_misses(self):
+        cache = TwoTierCache(FailingBackend()).start()
+        loader = Loader("value")
+        with self.assertLogs("cache", level="WARNING"):
+            self.assertEqual(cache.get("key", loader, 60), "value")
+        self.assertEqual(cache.get("key", Loader(), 60), "value")
+        with self.assertLogs("cache", level="ERROR"):
+            cache.invalidate("key")
+        self.assertEqual(cache.get("key", Loader("reloaded"), 60), "reloaded")
+
+    def test_unshared_values_stay_out_of_the_back_tier(self):
+        back = LocalBackend()
+        cache = TwoTierCache(back).start()
+        cache.get("secret", Loader("token"), 60, shared=False)
+        self.assertIsNone(back.get("secret"))
+
+
+if __name__ == "__main__":
+    unittest.main()
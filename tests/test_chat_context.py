@@ -0,0 +1,77 @@
+import json
+import unittest
+from unittest import mock
+
+import chat_context
+from chat_context import build_payload, new_state
+
+
+def conversation(turns):
+    # session_state.conversation layout: newest first, user message before the answer
+    messages = []
+    for question, answer in reversed(turns):
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "assistant", "content": answer})
+    return messages
+
+
+def turn(index, length=40):
+    return (f"Question {index}? " + "q" * length, f"Answer {index}. " + "a" * length)
+
+
+class BuildPayloadTest(unittest.TestCase):
+    def test_each_turn_is_folded_exactly_once(self):
+        state = new_state()
+        turns = []
+        with mock.patch.object(chat_context, "MAX_RECENT_TURNS", 2):
+            for index in range(10):
+                payload = build_payload("next", "analysis-1", conversation(turns), state)
+                recent = payload["context"]["recent_turns"]
+                self.assertLessEqual(len(recent), 4)
+                # Every earlier turn is either in the summary or in the recent window
+                self.assertEqual(state["folded"] + len(recent) // 2, len(turns))
+                turns.append(turn(index))
+
+        summary = payload["context"]["summary"]
+        for index in range(state["folded"]):
+            self.assertEqual(summary.count(f"Q: Question {index}?"), 1)
+        self.assertEqual(len(state["summary_lines"]), state["folded"])
+
+    def test_summary_stays_within_budget(self):
+        state = new_state()
+        turns = [turn(index, length=300) for index in range(50)]
+        with mock.patch.object(chat_context, "SUMMARY_TOKEN_BUDGET", 100), \
+                mock.patch.object(chat_context, "MAX_RECENT_TURNS", 2):
+            payload = build_payload("next", "analysis-1", conversation(turns), state)
+        lines = state["summary_lines"]
+        self.assertLessEqual(chat_context.estimate_tokens("\n".join(lines)), 100)
+        self.assertGreater(state["dropped"], 0)
+        self.assertEqual(state["dropped"] + len(lines), state["folded"])
+        self.assertTrue(payload["context"]["summary"].startswith(f"({state['dropped']} earlier exchanges omitted)"))
+
+    def test_payload_size_stays_flat(self):
+        state = new_state()
+        turns = []
+        sizes = []
+        for index in range(60):
+            payload = build_payload("What else?", "analysis-1", conversation(turns), state)
+            sizes.append(len(json.dumps(payload)))
+            turns.append(turn(index, length=400))
+        self.assertLess(max(sizes[30:]), max(sizes[:30]) * 1.5)
+
+    def test_state_resets_when_the_conversation_is_cleared(self):
+        state = new_state()
+        turns = [turn(index) for index in range(12)]
+        with mock.patch.object(chat_context, "MAX_RECENT_TURNS", 2):
+            build_payload("next", "analysis-1", conversation(turns), state)
+            self.assertGreater(state["folded"], 0)
+
+            # Logout empties session_state.conversation
+            payload = build_payload("first question again", "analysis-2", [], state)
+        self.assertEqual(state, new_state())
+        self.assertEqual(payload["context"], {"summary": "", "recent_turns": []})
+        self.assertEqual(payload["analysis_id"], "analysis-2")
+
+
+if __name__ == "__main__":
+    unittest.main()
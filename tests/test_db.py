@@ -0,0 +1,48 @@
+import unittest
+from unittest import mock
+
+import psycopg2
+
+from db import ReadRouter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ReadRouterTest(unittest.TestCase):
+    def test_reader_pool_is_built_on_first_use(self):
+        reader = object()
+        make_reader = mock.Mock(return_value=reader)
+        router = ReadRouter(primary=object(), make_reader=make_reader)
+        self.assertTrue(router.has_reader)
+        make_reader.assert_not_called()
+        self.assertIs(router.get_reader(), reader)
+        self.assertIs(router.get_reader(), reader)
+        make_reader.assert_called_once()
+
+    def test_failed_reader_build_is_retried_after_backoff(self):
+        clock = FakeClock()
+        reader = object()
+        make_reader = mock.Mock(side_effect=[psycopg2.OperationalError("replica down"), reader])
+        with mock.patch("db.time.monotonic", clock):
+            router = ReadRouter(primary=object(), make_reader=make_reader, down_backoff_s=30.0)
+            self.assertIsNone(router.get_reader())
+            clock.now += 10
+            self.assertIsNone(router.get_reader())
+            self.assertEqual(make_reader.call_count, 1)
+            clock.now += 20
+            self.assertIs(router.get_reader(), reader)
+
+    def test_without_replica(self):
+        router = ReadRouter(primary=object())
+        self.assertFalse(router.has_reader)
+        self.assertIsNone(router.get_reader())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import threading
+import time
+import unittest
+
+from health import HealthChecker
+
+
+def wait_for(condition, timeout_s=5.0):
+    deadline = time.monotonic() + timeout_s
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.005)
+
+
+class HealthCheckerTest(unittest.TestCase):
+    def test_readiness_serves_cached_results_without_waiting(self):
+        release = threading.Event()
+        checker = HealthChecker(timeout_s=5.0)
+        checker.add_probe("slow", lambda: release.wait(5))
+        checker.add_probe("fast", lambda: None)
+
+        started = time.monotonic()
+        ready, body = checker.readiness()
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertFalse(ready)
+        self.assertEqual(body["checks"]["slow"]["status"], "pending")
+
+        wait_for(lambda: checker.readiness()[1]["checks"]["fast"]["status"] == "ok")
+        self.assertEqual(checker.readiness()[1]["checks"]["slow"]["status"], "pending")
+        release.set()
+        wait_for(lambda: checker.readiness()[0])
+
+    def test_probes_refresh_concurrently(self):
+        checker = HealthChecker(timeout_s=5.0)
+        for name in ("a", "b", "c"):
+            checker.add_probe(name, lambda: time.sleep(0.3))
+        started = time.monotonic()
+        checker.refresh()
+        wait_for(lambda: checker.readiness()[0])
+        self.assertLess(time.monotonic() - started, 0.8)
+
+    def test_failing_critical_probe_makes_node_unready(self):
+        def fail():
+            raise RuntimeError("down")
+
+        checker = HealthChecker(timeout_s=1.0)
+        checker.add_probe("database", fail)
+        checker.add_probe("ses", fail, critical=False)
+        checker.refresh()
+        wait_for(lambda: checker.readiness()[1]["checks"]["database"]["status"] == "error")
+        ready, body = checker.readiness()
+        self.assertFalse(ready)
+        self.assertEqual(body["checks"]["database"]["error"], "down")
+
+    def test_hung_probe_times_out(self):
+        release = threading.Event()
+        checker = HealthChecker(timeout_s=0.1)
+        checker.add_probe("backend", lambda: release.wait(5))
+        checker.refresh()
+        wait_for(lambda: checker.readiness()[1]["checks"]["backend"]["status"] == "timeout")
+        release.set()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import hashlib
+import unittest
+from unittest import mock
+
+import password_hashing
+from password_hashing import (
+    SCRYPT_MIN_N,
+    SCRYPT_P,
+    SCRYPT_R,
+    UNUSABLE_PASSWORD,
+    hash_password,
+    is_legacy_hash,
+    verify_password,
+)
+
+
+def setUpModule():
+    # One small worker and the minimum cost, so the tests don't calibrate
+    patches = [
+        mock.patch.object(password_hashing, "PASSWORD_HASH_WORKERS", 1),
+        mock.patch.object(password_hashing, "_scrypt_n", SCRYPT_MIN_N),
+    ]
+    for patch in patches:
+        patch.start()
+        unittest.addModuleCleanup(patch.stop)
+    unittest.addModuleCleanup(password_hashing.shutdown)
+
+
+class VerifyPasswordTest(unittest.TestCase):
+    def test_scrypt_hash_round_trip(self):
+        stored = hash_password("correct horse")
+        self.assertTrue(stored.startswith(f"scrypt${SCRYPT_MIN_N}${SCRYPT_R}${SCRYPT_P}$"))
+        self.assertEqual(verify_password("correct horse", stored), (True, False))
+        self.assertEqual(verify_password("wrong horse", stored), (False, False))
+
+    def test_legacy_sha256_matches_and_needs_rehash(self):
+        legacy = hashlib.sha256(b"old password").hexdigest()
+        self.assertTrue(is_legacy_hash(legacy))
+        self.assertEqual(verify_password("old password", legacy), (True, True))
+        self.assertEqual(verify_password("other password", legacy), (False, False))
+
+    def test_under_cost_hash_needs_rehash(self):
+        stored = hash_password("correct horse")
+        with mock.patch.object(password_hashing, "_scrypt_n", SCRYPT_MIN_N * 2):
+            self.assertEqual(verify_password("correct horse", stored), (True, True))
+            # A wrong password never asks for a rehash
+            self.assertEqual(verify_password("wrong horse", stored), (False, False))
+
+    def test_unusable_password_matches_nothing(self):
+        self.assertFalse(is_legacy_hash(UNUSABLE_PASSWORD))
+        for password in ("", "!", UNUSABLE_PASSWORD):
+            self.assertEqual(verify_password(password, UNUSABLE_PASSWORD), (False, False))
+
+    def test_missing_or_unknown_hash_matches_nothing(self):
+        self.assertEqual(verify_password("anything", None), (False, False))
+        self.assertEqual(verify_password("anything", "bcrypt$whatever"), (False, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import io
+import unittest
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, NameObject
+
+from pdf_sharding import split_pdf
+
+VECTOR_ONLY = b"0 0 1 rg 72 72 m 300 300 l 300 72 l f 1 w 72 400 m 500 400 l S"
+INLINE_IMAGE = b"q 100 0 0 100 72 72 cm BI /W 2 /H 1 /CS /G /BPC 8 ID \x00\xff EI Q"
+# Sets state but paints nothing
+NO_MARKS = b"q 1 0 0 1 0 0 cm 0 g Q"
+
+
+def make_pdf(contents):
+    writer = PdfWriter()
+    for content in contents:
+        page = writer.add_blank_page(width=612, height=792)
+        if content is not None:
+            stream = DecodedStreamObject()
+            stream.set_data(content)
+            page[NameObject("/Contents")] = writer._add_object(stream)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def page_ranges(shards):
+    return [(first, last) for first, last, _ in shards]
+
+
+class SplitPdfTest(unittest.TestCase):
+    def test_keeps_vector_only_and_inline_image_pages(self):
+        data = make_pdf([VECTOR_ONLY, INLINE_IMAGE, VECTOR_ONLY.replace(b"300 72", b"310 72"), INLINE_IMAGE + b" "])
+        shards = split_pdf(data, 2)
+        self.assertEqual(page_ranges(shards), [(1, 2), (3, 4)])
+        self.assertEqual(sum(len(PdfReader(io.BytesIO(pdf)).pages) for _, _, pdf in shards), 4)
+
+    def test_skips_blank_and_duplicate_pages(self):
+        data = make_pdf([VECTOR_ONLY, None, NO_MARKS, VECTOR_ONLY, INLINE_IMAGE])
+        shards = split_pdf(data, 10)
+        self.assertEqual(page_ranges(shards), [(1, 5)])
+        self.assertEqual(len(PdfReader(io.BytesIO(shards[0][2])).pages), 2)
+
+    def test_all_blank_pages_give_no_shards(self):
+        self.assertEqual(split_pdf(make_pdf([None, NO_MARKS]), 10), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import threading
+import unittest
+
+from singleflight import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_concurrent_callers_share_one_execution(self):
+        flight = SingleFlight("test")
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def work():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "result"
+
+        leader = threading.Thread(target=lambda: results.append(flight.do("key", work)))
+        leader.start()
+        self.assertTrue(started.wait(5))
+        followers = [threading.Thread(target=lambda: results.append(flight.do("key", work))) for _ in range(3)]
+        for thread in followers:
+            thread.start()
+        while flight.stats()["coalesced"] < 3:
+            threading.Event().wait(0.005)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["result"] * 4)
+        self.assertEqual(flight.stats(), {"executed": 1, "coalesced": 3, "in_flight": 0})
+
+    def test_exception_reaches_every_caller(self):
+        flight = SingleFlight("test")
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def work():
+            started.set()
+            release.wait(5)
+            raise ValueError("backend down")
+
+        def call():
+            try:
+                flight.do("key", work)
+            except ValueError as e:
+                errors.append(str(e))
+
+        leader = threading.Thread(target=call)
+        leader.start()
+        self.assertTrue(started.wait(5))
+        follower = threading.Thread(target=call)
+        follower.start()
+        while flight.stats()["coalesced"] < 1:
+            threading.Event().wait(0.005)
+        release.set()
+        leader.join()
+        follower.join()
+
+        self.assertEqual(errors, ["backend down", "backend down"])
+
+    def test_results_are_not_cached(self):
+        flight = SingleFlight("test")
+        self.assertEqual(flight.do("key", lambda: 1), 1)
+        self.assertEqual(flight.do("key", lambda: 2), 2)
+        self.assertEqual(flight.do("other", lambda x: x, 3), 3)
+        self.assertEqual(flight.stats(), {"executed": 3, "coalesced": 0, "in_flight": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
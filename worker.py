@@ -0,0 +1,43 @@
+import argparse
+import logging
+import signal
+import threading
+
+from job_queue import JobWorkerPool
+
+# Standalone analysis workers, scaled independently of the Streamlit replicas:
+#   JOB_WORKERS_IN_PROCESS=0 streamlit run app.py     (UI only enqueues)
+#   python worker.py --threads 8                       (on any number of hosts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run analysis job workers")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--metrics-interval", type=float, default=60.0)
+    args = parser.parse_args()
+
+    # Loads the secrets, database settings and backend client from the app
+    import app
+
+    pool = JobWorkerPool(
+        app.get_db_router().connection,
+        app.process_analysis_job,
+        threads=args.threads,
+        poll_interval_s=args.poll_interval,
+        visibility_timeout_s=app.JOB_VISIBILITY_TIMEOUT_S,
+        metrics_interval_s=args.metrics_interval,
+    ).start()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    stop.wait()
+
+    logging.info("Stopping analysis workers")
+    pool.stop()
+
+
+if __name__ == "__main__":
+    main()